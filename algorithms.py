@@ -1,25 +1,107 @@
-import io
-from PIL import Image
 from rdkit import Chem, DataStructs
 from rdkit.Chem import AllChem, MACCSkeys, Draw 
 from rdkit.Chem.Draw import SimilarityMaps 
 import numpy as np
 import pandas as pd
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 from abc import ABC, abstractmethod
-import base64
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from transport import encode_drawing, encode_image
 
-def check_textarea_input(textarea: str):
-    smiles_str = [x.strip() for x in textarea.split(",")]
-    for smiles in smiles_str:
-        molecule = Chem.MolFromSmiles(smiles, sanitize=False)
+class ParsedInput:
+    def __init__(self):
+        self.smiles = []
+        self.canonical_smiles = []
+        self.identifiers = []
+        self.molecules = []
+        self.packed_fingerprints = None
+        self.invalid = []
+        self.duplicates = []
+        self.seen = set()
+
+def parse_smiles(smiles_list:list, identifiers:list=None, parsed:ParsedInput=None, start:int=1):
+    parsed = parsed if parsed is not None else ParsedInput()
+    identifiers = identifiers if identifiers is not None else smiles_list
+    for position, (smiles, identifier) in enumerate(zip(smiles_list, identifiers), start=start):
+        if smiles is None:
+            parsed.invalid.append((position, "unreadable record"))
+            continue
+        if not smiles:
+            continue
+        molecule = Chem.MolFromSmiles(smiles)
         if molecule is None:
-            return False
-    for element in smiles_str[:]:
-        if not element.strip():
-            smiles_str.remove(element)
-    return smiles_str
+            parsed.invalid.append((position, smiles))
+            continue
+        canonical_smiles = Chem.MolToSmiles(molecule)
+        if canonical_smiles in parsed.seen:
+            parsed.duplicates.append((position, smiles))
+            continue
+        parsed.seen.add(canonical_smiles)
+        parsed.smiles.append(smiles)
+        parsed.canonical_smiles.append(canonical_smiles)
+        parsed.identifiers.append(identifier)
+        parsed.molecules.append(molecule)
+    return parsed
+
+def get_drawing_canvas(size:tuple, image_format:str):
+    if image_format == 'svg':
+        return Draw.MolDraw2DSVG(*size)
+    elif image_format in IMAGE_FORMATS:
+        return Draw.MolDraw2DCairo(*size)
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+
+def get_canonical_smiles(smiles:str):
+    return Chem.MolToSmiles(Chem.MolFromSmiles(smiles))
+
+def parse_textarea_input(textarea:str):
+    return parse_smiles([x.strip() for x in re.split(r"[,\r\n]", textarea)])
+
+FINGERPRINT_PARAMETERS = {
+    "RDKit": ('min_path', 'max_path', 'fps_rdkit'),
+    "Morgan": ('radius', 'fps_morgan'),
+    "AtomPairs": ('fps_atompairs',),
+    "MACCS Keys": ()
+}
+
+ESTIMATED_ATOM_BYTES = 512
+ESTIMATED_BIT_INFO_BYTES = 64
+
+PARALLEL_FINGERPRINT_THRESHOLD = 5000
+FINGERPRINT_CHUNK_SIZE = 1000
+
+SIMILARITY_STRATEGIES = ['Tanimoto', 'Dice', 'Cosine', 'Sokal', 'Russel', 'Kulczynski', 'McConnaughey', 'Tversky']
+
+SIMILARITY_DTYPES = ['float64', 'float32', 'uint8']
+SIMILARITY_SCALE = 100
+
+IMAGE_FORMATS = ['svg', 'png', 'webp']
+MOLECULE_IMAGE_SIZE = (400, 400)
+MOLECULE_IMAGE_FORMAT = 'svg'
+SIMILARITY_MAP_SIZE = (600, 410)
+SIMILARITY_MAP_FORMAT = 'webp'
+GRID_COLUMNS = 4
+GRID_IMAGE_SIZE = (200, 200)
+GRID_IMAGE_FORMAT = 'svg'
+HEATMAP_POOLING = ['max', 'mean']
+LINKAGE_METHODS = ['complete', 'average', 'single', 'weighted']
+APPROXIMATE_CLUSTERING_LEAVES = 1000
+
+SIMILARITY_BLOCK_SIZE = 64
+QUERY_BLOCK_SIZE = 8
+LIBRARY_CHUNK_SIZE = 10000
+SIMILARITY_COLUMN_BLOCK_SIZE = 512
+COUNT_BOUND_TOLERANCE = 1e-6
 
 class FingerprintGenerator(ABC):
+    collects_additional_output = False
+
     @abstractmethod
     def get_fingerprint_generator():
         pass
@@ -28,7 +110,23 @@ class FingerprintGenerator(ABC):
     def generate_fingerprints():
         pass
 
+    def generate_fingerprints_with_ao(self, molecules:list, data:dict):
+        return self.generate_fingerprints(molecules, data), None
+
+    def generate_fingerprints_parallel(self, smiles:list, data:dict, workers:int):
+        chunks = [smiles[i:i + FINGERPRINT_CHUNK_SIZE] for i in range(0, len(smiles), FINGERPRINT_CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(partial(generate_fingerprint_chunk, type(self), data=data), chunks)
+            return [DataStructs.ExplicitBitVect(x) for chunk in results for x in chunk]
+
+def generate_fingerprint_chunk(generator_class:type, smiles:list, data:dict):
+    molecules = [Chem.MolFromSmiles(x) for x in smiles]
+    return [fp.ToBinary() for fp in generator_class().generate_fingerprints(molecules, data)]
+
 class RDKitFingerprintGenerator(FingerprintGenerator):
+    name = "RDKit"
+    collects_additional_output = True
+
     def get_fingerprint_generator(self, data:dict):
         return AllChem.GetRDKitFPGenerator(minPath=data['min_path'], maxPath=data['max_path'], fpSize=data['fps_rdkit'])
     
@@ -53,6 +151,8 @@ class RDKitFingerprintGenerator(FingerprintGenerator):
         return fps, additional_outputs
     
 class AtomPairsFingerprintGenerator(FingerprintGenerator):
+    name = "AtomPairs"
+
     def get_fingerprint_generator(self, data:dict):
         return AllChem.GetAtomPairGenerator(fpSize=data['fps_atompairs'])
 
@@ -62,6 +162,9 @@ class AtomPairsFingerprintGenerator(FingerprintGenerator):
         return fps
 
 class MorganFingerprintGenerator(FingerprintGenerator):
+    name = "Morgan"
+    collects_additional_output = True
+
     def get_fingerprint_generator(self, data:dict):
         return AllChem.GetMorganGenerator(radius=data['radius'], fpSize=data['fps_morgan'])
     
@@ -86,6 +189,8 @@ class MorganFingerprintGenerator(FingerprintGenerator):
         return fps, additional_outputs
 
 class MACCSKeysFingerprintGenerator(FingerprintGenerator):
+    name = "MACCS Keys"
+
     def get_fingerprint_generator():
         pass
     
@@ -93,86 +198,580 @@ class MACCSKeysFingerprintGenerator(FingerprintGenerator):
         fps = [MACCSkeys.GenMACCSKeys(x) for x in molecules]
         return fps
     
+def fill_row_tiles(size:int, fill_tile, workers:int, tile_size:int=SIMILARITY_BLOCK_SIZE):
+    tiles = [(start, min(start + tile_size, size)) for start in range(0, size, tile_size)]
+    if workers <= 1 or len(tiles) <= 1:
+        for start, stop in tiles:
+            fill_tile(start, stop)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda tile: fill_tile(*tile), tiles):
+            pass
+
+def iter_row_tiles(size:int, get_tile, workers:int, tile_size:int=SIMILARITY_BLOCK_SIZE):
+    tiles = [(start, min(start + tile_size, size)) for start in range(0, size, tile_size)]
+    if workers <= 1 or len(tiles) <= 1:
+        for start, stop in tiles:
+            yield start, get_tile(start, stop)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, stop in tiles:
+            pending.append((start, executor.submit(get_tile, start, stop)))
+            if len(pending) >= 2 * workers:
+                start, future = pending.popleft()
+                yield start, future.result()
+        while pending:
+            start, future = pending.popleft()
+            yield start, future.result()
+
+class PackedFingerprints:
+    def __init__(self, fingerprints:list=None):
+        fingerprints = fingerprints if fingerprints is not None else []
+        self.size = fingerprints[0].GetNumBits() if fingerprints else 0
+        packed = np.zeros((len(fingerprints), -(-self.size // 64) * 8), dtype=np.uint8)
+        for i, fingerprint in enumerate(fingerprints):
+            row = np.frombuffer(DataStructs.BitVectToBinaryText(fingerprint), dtype=np.uint8)
+            packed[i, :len(row)] = row
+        self.words = packed.view(np.uint64)
+        self.popcounts = np.bitwise_count(self.words).sum(axis=1, dtype=np.int64)
+
+    @classmethod
+    def from_words(cls, words:np.ndarray, size:int, popcounts:np.ndarray=None):
+        packed = cls()
+        packed.size = size
+        packed.words = words
+        packed.popcounts = popcounts if popcounts is not None else np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+        return packed
+
+    @classmethod
+    def concatenate(cls, parts:list):
+        return cls.from_words(np.concatenate([x.words for x in parts]), parts[0].size, np.concatenate([x.popcounts for x in parts]))
+
+    def __len__(self):
+        return len(self.words)
+
+    def get_size(self):
+        return self.words.nbytes + self.popcounts.nbytes
+
+    def get_intersections(self, rows:slice, columns:slice, other:"PackedFingerprints"=None):
+        words = self.words[rows]
+        others = (other if other is not None else self).words[columns]
+        intersections = np.empty((len(words), len(others)), dtype=np.int64)
+        for start in range(0, len(others), SIMILARITY_COLUMN_BLOCK_SIZE):
+            stop = start + SIMILARITY_COLUMN_BLOCK_SIZE
+            intersections[:, start:stop] = np.bitwise_count(words[:, None, :] & others[None, start:stop, :]).sum(axis=2)
+        return intersections
+
+    def get_common_counts(self, workers:int=1):
+        common = np.zeros((len(self), len(self)), dtype=np.uint16 if self.size < 2 ** 16 else np.uint32)
+
+        def fill_tile(start:int, stop:int):
+            block = self.get_intersections(slice(start, stop), slice(start, len(self)))
+            common[start:stop, start:] = block
+            common[start:, start:stop] = block.T
+
+        fill_row_tiles(len(self), fill_tile, workers)
+        return common
+
+class MoleculeSet:
+    def __init__(self, smiles:list, generation_strategy:FingerprintGenerator, data:dict, molecules:list=None, workers:int=None,
+                 packed_fingerprints:PackedFingerprints=None):
+        self.smiles = smiles
+        self.workers = workers if workers is not None else os.cpu_count()
+        if molecules is None and packed_fingerprints is None:
+            molecules = [Chem.MolFromSmiles(x) for x in smiles]
+        self.molecules = molecules
+        self.positions = None
+        self.generation_strategy = generation_strategy
+        self.data = data
+        self.fingerprints = None
+        self.packed_fingerprints = packed_fingerprints
+        self.common_counts = None
+        self.bit_info = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        state['positions'] = None
+        return state
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        self.positions = None
+        self.lock = threading.Lock()
+
+    def get_molecules(self):
+        if self.molecules is None:
+            self.molecules = [Chem.MolFromSmiles(x) for x in self.smiles]
+        return self.molecules
+
+    def get_position(self, smiles:str):
+        molecule = Chem.MolFromSmiles(smiles)
+        if molecule is None:
+            return None
+        if self.positions is None:
+            self.positions = {Chem.MolToSmiles(x): i for i, x in enumerate(self.get_molecules()) if x is not None}
+        return self.positions.get(Chem.MolToSmiles(molecule))
+
+    def get_molecule(self, smiles:str):
+        position = self.get_position(smiles)
+        if position is None:
+            return Chem.MolFromSmiles(smiles)
+        return self.get_molecules()[position]
+
+    def get_fingerprints(self):
+        with self.lock:
+            if self.fingerprints is None:
+                if len(self.smiles) >= PARALLEL_FINGERPRINT_THRESHOLD and self.workers > 1:
+                    self.fingerprints = self.generation_strategy.generate_fingerprints_parallel(self.smiles, self.data, self.workers)
+                else:
+                    self.fingerprints = self.generation_strategy.generate_fingerprints(self.get_molecules(), self.data)
+                self.bit_info = dict()
+            return self.fingerprints
+
+    def get_packed_fingerprints(self):
+        with self.lock:
+            if self.packed_fingerprints is not None:
+                return self.packed_fingerprints
+        fingerprints = self.get_fingerprints()
+        with self.lock:
+            if self.packed_fingerprints is None:
+                self.packed_fingerprints = PackedFingerprints(fingerprints)
+            return self.packed_fingerprints
+
+    def get_common_counts(self):
+        packed = self.get_packed_fingerprints()
+        with self.lock:
+            if self.common_counts is None:
+                self.common_counts = packed.get_common_counts(self.workers)
+            return self.common_counts
+
+    def get_on_bits(self, smiles:str):
+        position = self.get_position(smiles)
+        if position is None:
+            raise KeyError(smiles)
+        return list(self.get_fingerprints()[position].GetOnBits())
+
+    def get_bit_info(self, smiles:str):
+        if not self.generation_strategy.collects_additional_output:
+            return None
+        self.get_fingerprints()
+        position = self.get_position(smiles)
+        if position is None:
+            raise KeyError(smiles)
+        with self.lock:
+            if position not in self.bit_info:
+                _, additional_outputs = self.generation_strategy.generate_fingerprints_with_ao([self.get_molecules()[position]], self.data)
+                self.bit_info[position] = additional_outputs[0]
+            return self.bit_info[position]
+
+    def get_size(self):
+        size = sum(len(x) for x in self.smiles)
+        if self.molecules is not None:
+            size += sum(mol.GetNumAtoms() + mol.GetNumBonds() for mol in self.molecules if mol is not None) * ESTIMATED_ATOM_BYTES
+        if self.fingerprints is not None:
+            size += sum(fp.GetNumBits() // 8 for fp in self.fingerprints)
+        if self.packed_fingerprints is not None:
+            size += self.packed_fingerprints.words.nbytes
+        if self.common_counts is not None:
+            size += self.common_counts.nbytes
+        if self.bit_info is not None:
+            size += sum(len(info) for info in self.bit_info.values()) * ESTIMATED_BIT_INFO_BYTES
+        return size
+
+def quantize(block:np.ndarray, dtype:type):
+    if np.issubdtype(dtype, np.integer):
+        return np.rint(np.asarray(block) * SIMILARITY_SCALE)
+    return block
+
+def dequantize(block:np.ndarray):
+    if np.issubdtype(block.dtype, np.integer):
+        return block / SIMILARITY_SCALE
+    return block
+
+def get_pooling_edges(size:int, max_size:int):
+    return np.linspace(0, size, min(size, max_size) + 1).astype(np.int64)
+
+def pool_matrix(block:np.ndarray, max_size:int, pooling:str="max"):
+    row_edges = get_pooling_edges(block.shape[0], max_size)
+    column_edges = get_pooling_edges(block.shape[1], max_size)
+    if pooling == "max":
+        pooled = np.maximum.reduceat(block, row_edges[:-1], axis=0)
+        pooled = np.maximum.reduceat(pooled, column_edges[:-1], axis=1)
+    elif pooling == "mean":
+        pooled = np.add.reduceat(block, row_edges[:-1], axis=0, dtype=np.float64)
+        pooled = np.add.reduceat(pooled, column_edges[:-1], axis=1)
+        pooled /= np.outer(np.diff(row_edges), np.diff(column_edges))
+        if np.issubdtype(block.dtype, np.integer):
+            pooled = np.rint(pooled).astype(block.dtype)
+    else:
+        raise ValueError(f"Unknown pooling: {pooling}")
+    return pooled, row_edges, column_edges
+
+def divide(numerator:np.ndarray, denominator:np.ndarray):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    result = np.zeros(np.broadcast_shapes(numerator.shape, denominator.shape))
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
 class SimilarityStrategy(ABC):
-    @abstractmethod
-    def generate_similarity_matrix():
-        pass
+    symmetric = True
+    signed = False
+    count_bounded = False
 
-class TanimotoStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
+    def generate_similarity_matrix(self, fingerprints:list, *weights):
         matrix = np.zeros((len(fingerprints), len(fingerprints)))
         for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkTanimotoSimilarity(fingerprints[i], fingerprints)
+            matrix[i, :] = self.get_bulk_similarity(fingerprints[i], fingerprints, *weights)
         return matrix
+
+    @abstractmethod
+    def get_bulk_similarity():
+        pass
+
+    @abstractmethod
+    def get_similarity_from_counts():
+        pass
+
+    def get_count_bounds(self, counts:np.ndarray, threshold:float, *weights):
+        return np.zeros_like(counts), np.full_like(counts, np.inf)
+
+class TanimotoStrategy(SimilarityStrategy):
+    count_bounded = True
+
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkTanimotoSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common, count_a + count_b - common)
+
+    def get_count_bounds(self, counts:np.ndarray, threshold:float):
+        return counts * threshold, counts / threshold
     
 class DiceStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkDiceSimilarity(fingerprints[i], fingerprints)
-        return matrix
+    count_bounded = True
+
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkDiceSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(2 * common, count_a + count_b)
+
+    def get_count_bounds(self, counts:np.ndarray, threshold:float):
+        return counts * threshold / (2 - threshold), counts * (2 - threshold) / threshold
 
 class CosineStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkCosineSimilarity(fingerprints[i], fingerprints)
-        return matrix
+    count_bounded = True
+
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkCosineSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common, np.sqrt(count_a * count_b))
+
+    def get_count_bounds(self, counts:np.ndarray, threshold:float):
+        return counts * threshold ** 2, counts / threshold ** 2
     
 class SokalStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkSokalSimilarity(fingerprints[i], fingerprints)
-        return matrix
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkSokalSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common, 2 * count_a + 2 * count_b - 3 * common)
 
 class RusselStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkRusselSimilarity(fingerprints[i], fingerprints)
-        return matrix
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkRusselSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common, np.full_like(common, size))
     
 class KulczynskiStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkKulczynskiSimilarity(fingerprints[i], fingerprints)
-        return matrix
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkKulczynskiSimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common * (count_a + count_b), 2 * count_a * count_b)
 
 class McConnaugheyStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkMcConnaugheySimilarity(fingerprints[i], fingerprints)
-        return matrix
+    signed = True
+
+    def get_bulk_similarity(self, fingerprint, fingerprints:list):
+        return DataStructs.BulkMcConnaugheySimilarity(fingerprint, fingerprints)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int):
+        return divide(common * (count_a + count_b) - count_a * count_b, count_a * count_b)
     
 class TverskyStrategy(SimilarityStrategy):
-    def generate_similarity_matrix(self, fingerprints:list, a: int, b: int):
-        matrix = np.zeros((len(fingerprints), len(fingerprints)))
-        for i in range(len(fingerprints)):
-            matrix[i, :] = DataStructs.BulkTverskySimilarity(fingerprints[i], fingerprints, a, b)
-        return matrix
+    symmetric = False
+    count_bounded = True
+
+    def get_bulk_similarity(self, fingerprint, fingerprints:list, a: float, b: float):
+        return DataStructs.BulkTverskySimilarity(fingerprint, fingerprints, a, b)
+
+    def get_similarity_from_counts(self, common:np.ndarray, count_a:np.ndarray, count_b:np.ndarray, size:int, a: float, b: float):
+        denominator = a * (count_a - common) + b * (count_b - common) + common
+        return np.where((denominator == 0) & (count_a > 0) & (count_b > 0), 1.0, divide(common, denominator))
+
+    def get_count_bounds(self, counts:np.ndarray, threshold:float, a: float, b: float):
+        if a < 0 or b < 0:
+            return super().get_count_bounds(counts, threshold)
+        lower = divide(counts * threshold * a, 1 - threshold + threshold * a)
+        upper = counts * (1 - threshold + threshold * b) / (threshold * b) if b > 0 else np.full_like(counts, np.inf)
+        return lower, upper
     
+class SimilarityEngine(ABC):
+    @abstractmethod
+    def generate_similarity_matrix():
+        pass
+
+    @abstractmethod
+    def generate_similarity_rows():
+        pass
+
+class RDKitSimilarityEngine(SimilarityEngine):
+    def generate_similarity_matrix(self, molecule_set:MoleculeSet, similarity_strategy:SimilarityStrategy, weights:tuple=(), dtype:type=np.float64):
+        fingerprints = molecule_set.get_fingerprints()
+        matrix = np.zeros((len(fingerprints), len(fingerprints)), dtype=dtype)
+
+        def fill_tile(start:int, stop:int):
+            for i in range(start, stop):
+                first_column = i if similarity_strategy.symmetric else 0
+                row = quantize(similarity_strategy.get_bulk_similarity(fingerprints[i], fingerprints[first_column:], *weights), matrix.dtype)
+                matrix[i, first_column:] = row
+                if similarity_strategy.symmetric:
+                    matrix[first_column:, i] = row
+
+        fill_row_tiles(len(fingerprints), fill_tile, molecule_set.workers)
+        return matrix
+
+    def generate_similarity_rows(self, molecule_set:MoleculeSet, similarity_strategy:SimilarityStrategy, start:int, stop:int, weights:tuple=()):
+        fingerprints = molecule_set.get_fingerprints()
+        return np.array([similarity_strategy.get_bulk_similarity(fingerprints[i], fingerprints, *weights) for i in range(start, stop)])
+
+class NumpySimilarityEngine(SimilarityEngine):
+    def generate_similarity_matrix(self, molecule_set:MoleculeSet, similarity_strategy:SimilarityStrategy, weights:tuple=(), dtype:type=np.float64):
+        packed = molecule_set.get_packed_fingerprints()
+        common = molecule_set.get_common_counts()
+        matrix = np.zeros((len(packed), len(packed)), dtype=dtype)
+
+        def fill_tile(start:int, stop:int):
+            first_column = start if similarity_strategy.symmetric else 0
+            block = similarity_strategy.get_similarity_from_counts(common[start:stop, first_column:],
+                                                                   packed.popcounts[start:stop, None],
+                                                                   packed.popcounts[None, first_column:],
+                                                                   packed.size,
+                                                                   *weights)
+            block = quantize(block, matrix.dtype)
+            matrix[start:stop, first_column:] = block
+            if similarity_strategy.symmetric:
+                matrix[first_column:, start:stop] = block.T
+
+        fill_row_tiles(len(packed), fill_tile, molecule_set.workers)
+        return matrix
+
+    def generate_similarity_rows(self, molecule_set:MoleculeSet, similarity_strategy:SimilarityStrategy, start:int, stop:int, weights:tuple=()):
+        packed = molecule_set.get_packed_fingerprints()
+        return similarity_strategy.get_similarity_from_counts(packed.get_intersections(slice(start, stop), slice(0, len(packed))),
+                                                              packed.popcounts[start:stop, None],
+                                                              packed.popcounts[None, :],
+                                                              packed.size,
+                                                              *weights)
+
+def select_neighbours(block:np.ndarray, start:int, top_k:int=None, threshold:float=None):
+    block = np.array(block, dtype=np.float64)
+    rows = np.arange(len(block))
+    block[rows, start + rows] = -np.inf
+    if top_k is not None and top_k < block.shape[1]:
+        columns = np.argpartition(-block, top_k - 1, axis=1)[:, :top_k]
+    else:
+        columns = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+    values = np.take_along_axis(block, columns, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    columns = np.take_along_axis(columns, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    keep = values > -np.inf
+    if threshold is not None:
+        keep &= values >= threshold
+    return keep.sum(axis=1), columns[keep], values[keep]
+
+class PopcountIndex:
+    def __init__(self, packed:PackedFingerprints):
+        self.order = np.argsort(packed.popcounts, kind='stable')
+        self.words = np.asarray(packed.words)[self.order]
+        self.popcounts = np.asarray(packed.popcounts)[self.order]
+        self.size = packed.size
+
+    def __len__(self):
+        return len(self.order)
+
+    def get_size(self):
+        return self.order.nbytes + self.words.nbytes + self.popcounts.nbytes
+
+    def get_candidate_ranges(self, counts:np.ndarray, similarity_strategy:SimilarityStrategy, threshold:float, weights:tuple=()):
+        if threshold <= 0:
+            return np.zeros(len(counts), dtype=np.int64), np.full(len(counts), len(self), dtype=np.int64)
+        lower, upper = similarity_strategy.get_count_bounds(np.asarray(counts, dtype=np.float64), threshold, *weights)
+        starts = np.searchsorted(self.popcounts, lower - COUNT_BOUND_TOLERANCE, side='left')
+        stops = np.searchsorted(self.popcounts, upper + COUNT_BOUND_TOLERANCE, side='right')
+        return starts, np.maximum(starts, stops)
+
+    def search(self, queries:PackedFingerprints, rows:range, similarity_strategy:SimilarityStrategy, threshold:float, weights:tuple=(),
+               top_k:int=None, exclude_self:bool=False):
+        if queries.size != self.size:
+            raise ValueError("Query and index fingerprints must have the same length")
+        starts, stops = self.get_candidate_ranges(queries.popcounts[rows.start:rows.stop], similarity_strategy, threshold, weights)
+        counts = np.zeros(len(rows), dtype=np.int64)
+        indices = []
+        values = []
+        for position, row in enumerate(rows):
+            start, stop = starts[position], stops[position]
+            common = np.bitwise_count(self.words[start:stop] & queries.words[row]).sum(axis=1, dtype=np.int64)
+            similarity = similarity_strategy.get_similarity_from_counts(common, queries.popcounts[row], self.popcounts[start:stop], self.size, *weights)
+            columns = self.order[start:stop]
+            keep = similarity >= threshold
+            if exclude_self:
+                keep &= columns != row
+            columns, similarity = columns[keep], similarity[keep]
+            order = np.lexsort((columns, -similarity))[:top_k]
+            counts[position] = len(order)
+            indices.append(columns[order])
+            values.append(similarity[order])
+        return counts, np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64), np.concatenate(values) if values else np.zeros(0)
+
+class Clustering:
+    def __init__(self, linkage:np.ndarray, distances:np.ndarray, leaves:np.ndarray, labels:np.ndarray, similarity:np.ndarray=None):
+        self.linkage = linkage
+        self.distances = distances
+        self.leaves = leaves
+        self.labels = labels
+        self.similarity = similarity
+
+    def get_size(self):
+        size = self.linkage.nbytes + self.leaves.nbytes + self.labels.nbytes
+        if self.similarity is not None:
+            size += self.similarity.nbytes + self.distances.nbytes
+        return size
+
+    def get_leaf_labels(self, smiles:list):
+        if self.similarity is None:
+            return [smiles[i] for i in self.leaves]
+        sizes = np.bincount(self.labels, minlength=len(self.leaves))
+        return [f"{smiles[leaf]} ({size})" for leaf, size in zip(self.leaves, sizes)]
+
+    def get_clusters(self, cluster_count:int):
+        return hierarchy.fcluster(self.linkage, cluster_count, criterion='maxclust')[self.labels]
+
+def get_generation_strategy(strategy_name:str):
+    if strategy_name == "RDKit":
+        return RDKitFingerprintGenerator()
+    elif strategy_name == "Morgan":
+        return MorganFingerprintGenerator()
+    elif strategy_name == "AtomPairs":
+        return AtomPairsFingerprintGenerator()
+    elif strategy_name == "MACCS Keys":
+        return MACCSKeysFingerprintGenerator()
+    else:
+        raise ValueError(f"Unknown generation strategy: {strategy_name}")
+
+def pack_fingerprints(smiles:list, generation_strategy:FingerprintGenerator, data:dict, workers:int=None):
+    molecules = [Chem.MolFromSmiles(x) if x else None for x in smiles]
+    smiles = [x if molecule is not None else "" for x, molecule in zip(smiles, molecules)]
+    molecules = [molecule if molecule is not None else Chem.Mol() for molecule in molecules]
+    return MoleculeSet(smiles, generation_strategy, data, molecules, workers).get_packed_fingerprints()
+
+class ReferenceLibrary:
+    def __init__(self, smiles:list, identifiers:list=None, name:str="library", cache=None):
+        self.smiles = smiles
+        self.identifiers = identifiers if identifiers is not None else smiles
+        self.name = name
+        self.cache = cache
+        self.packed_fingerprints = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.smiles)
+
+    def get_fingerprint_key(self, fingerprint_type:str, data:dict):
+        return repr((self.name, fingerprint_type) + tuple(data.get(name) for name in FINGERPRINT_PARAMETERS[fingerprint_type]))
+
+    def get_packed_fingerprints(self, fingerprint_type:str, generation_strategy:FingerprintGenerator, data:dict, workers:int=None):
+        key = self.get_fingerprint_key(fingerprint_type, data)
+        with self.lock:
+            if key not in self.packed_fingerprints:
+                packed = self.cache.get(key) if self.cache is not None else None
+                if packed is None:
+                    parts = [pack_fingerprints(self.smiles[start:start + LIBRARY_CHUNK_SIZE], generation_strategy, data, workers)
+                             for start in range(0, len(self.smiles), LIBRARY_CHUNK_SIZE)]
+                    packed = PackedFingerprints.concatenate(parts)
+                    if self.cache is not None:
+                        self.cache.put(key, packed)
+                self.packed_fingerprints[key] = packed
+            return self.packed_fingerprints[key]
+
+def load_reference_library(path:str, cache=None):
+    smiles = []
+    identifiers = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            smiles.append(fields[0])
+            identifiers.append(fields[1] if len(fields) > 1 else fields[0])
+    return ReferenceLibrary(smiles, identifiers, os.path.abspath(path), cache)
+
+class QueryResult:
+    def __init__(self, queries:list, hits:np.ndarray, similarities:np.ndarray, hit_smiles:list, hit_identifiers:list, similarity:np.ndarray):
+        self.queries = queries
+        self.hits = hits
+        self.similarities = similarities
+        self.hit_smiles = hit_smiles
+        self.hit_identifiers = hit_identifiers
+        self.similarity = similarity
+
+    def get_size(self):
+        size = self.hits.nbytes + self.similarities.nbytes + self.similarity.nbytes
+        return size + sum(len(x) for x in self.hit_smiles) + sum(len(x) for x in self.hit_identifiers)
+
+    def get_data_frame(self):
+        return pd.DataFrame(np.round(self.similarity, 2), index=self.queries, columns=self.hit_smiles)
+
+    def get_pairs(self):
+        hits = self.hits.ravel()
+        pairs = pd.DataFrame({
+            'Molecule 1': np.repeat(self.queries, self.hits.shape[1]),
+            'Molecule 2': [self.hit_smiles[i] for i in hits],
+            'Library ID': [self.hit_identifiers[i] for i in hits],
+            'Similarity': np.round(self.similarities.ravel(), 2)
+        })
+        return pairs.sort_values('Similarity', ascending=False, kind='stable', ignore_index=True)
+
 class DataFrameGenerator:
-    def __init__(self, smiles:list, generation_strategy:str, similarity_strategy:str, data:dict):
+    def __init__(self, smiles:list, generation_strategy:str, similarity_strategy:str, data:dict, molecule_set:MoleculeSet=None, molecules:list=None,
+                 similarity_engine:str="RDKit", workers:int=None, similarity_dtype:str="float64", packed_fingerprints:PackedFingerprints=None):
         self.smiles = smiles
-        self.molecules = [Chem.MolFromSmiles(x) for x in smiles]
-        self.generation_strategy = self.get_generation_strategy(generation_strategy)
         self.similarity_strategy = self.get_similarity_strategy(similarity_strategy)
+        self.similarity_engine = self.get_similarity_engine(similarity_engine)
+        if similarity_dtype not in SIMILARITY_DTYPES:
+            raise ValueError(f"Unknown similarity dtype: {similarity_dtype}")
+        self.similarity_dtype = similarity_dtype
         self.data = data
+        if molecule_set is None:
+            molecule_set = MoleculeSet(smiles, self.get_generation_strategy(generation_strategy), data, molecules, workers, packed_fingerprints)
+        self.molecule_set = molecule_set
+        self.generation_strategy = molecule_set.generation_strategy
+        self.fingerprint_type = self.generation_strategy.name
+        self.molecules = molecule_set.molecules
+        self.similarity_matrix = None
+        self.condensed_distances = None
+        self.clusterings = dict()
 
     def get_generation_strategy(self, strategy_name:str):
-        if strategy_name == "RDKit":
-            return RDKitFingerprintGenerator()
-        elif strategy_name == "Morgan":
-            return MorganFingerprintGenerator()
-        elif strategy_name == "AtomPairs":
-            return AtomPairsFingerprintGenerator()
-        elif strategy_name == "MACCS Keys":
-            return MACCSKeysFingerprintGenerator()
-        else:
-            raise ValueError(f"Unknown generation strategy: {strategy_name}")
+        return get_generation_strategy(strategy_name)
     
     def get_similarity_strategy(self, strategy_name:str):
         if strategy_name == "Tanimoto":
@@ -194,55 +793,225 @@ class DataFrameGenerator:
         else:
             raise ValueError(f"Unknown similarity strategy: {strategy_name}") 
     
-    def get_data_frame(self):
-        fingerprints = self.generation_strategy.generate_fingerprints(self.molecules, self.data)
+    def get_similarity_engine(self, engine_name:str):
+        if engine_name == "RDKit":
+            return RDKitSimilarityEngine()
+        elif engine_name == "NumPy":
+            return NumpySimilarityEngine()
+        else:
+            raise ValueError(f"Unknown similarity engine: {engine_name}")
+
+    def get_fingerprints(self):
+        return self.molecule_set.get_fingerprints()
+
+    def get_similarity_weights(self):
         if isinstance(self.similarity_strategy, TverskyStrategy):
-            similarity_matrix = self.similarity_strategy.generate_similarity_matrix(fingerprints, float(self.data['a']), float(self.data['b']))
+            return float(self.data['a']), float(self.data['b'])
+        return ()
+
+    def get_similarity_dtype(self):
+        if self.similarity_dtype == "uint8" and self.similarity_strategy.signed:
+            return np.int8
+        return np.dtype(self.similarity_dtype).type
+
+    def get_similarity_matrix(self):
+        if self.similarity_matrix is None:
+            self.similarity_matrix = self.similarity_engine.generate_similarity_matrix(self.molecule_set,
+                                                                                       self.similarity_strategy,
+                                                                                       self.get_similarity_weights(),
+                                                                                       self.get_similarity_dtype())
+        return self.similarity_matrix
+
+    def get_condensed_distances(self):
+        if self.condensed_distances is None:
+            similarity_matrix = self.get_similarity_matrix()
+            size = len(similarity_matrix)
+            condensed = np.empty(size * (size - 1) // 2)
+            position = 0
+            for i in range(size - 1):
+                row = similarity_matrix[i, i + 1:]
+                if not self.similarity_strategy.symmetric:
+                    row = (row.astype(np.float64) + similarity_matrix[i + 1:, i]) / 2
+                condensed[position:position + len(row)] = row
+                position += len(row)
+            if np.issubdtype(similarity_matrix.dtype, np.integer):
+                condensed /= SIMILARITY_SCALE
+            self.condensed_distances = np.subtract(1, condensed, out=condensed)
+        return self.condensed_distances
+
+    def get_clustering(self, method:str="complete", approximate:bool=False, max_leaves:int=APPROXIMATE_CLUSTERING_LEAVES):
+        if method not in LINKAGE_METHODS:
+            raise ValueError(f"Unknown linkage method: {method}")
+        approximate = approximate and len(self.smiles) > max_leaves
+        key = (method, approximate, max_leaves if approximate else None)
+        if key not in self.clusterings:
+            if approximate:
+                self.clusterings[key] = self.get_approximate_clustering(method, max_leaves)
+            else:
+                distances = self.get_condensed_distances()
+                leaves = np.arange(len(self.smiles))
+                self.clusterings[key] = Clustering(hierarchy.linkage(distances, method), distances, leaves, leaves)
+        return self.clusterings[key]
+
+    def get_size(self):
+        size = 0
+        if self.similarity_matrix is not None:
+            size += self.similarity_matrix.nbytes
+        if self.condensed_distances is not None:
+            size += self.condensed_distances.nbytes
+        for clustering in self.clusterings.values():
+            size += clustering.get_size()
+        return size
+
+    def get_approximate_clustering(self, method:str, max_leaves:int):
+        packed = self.molecule_set.get_packed_fingerprints()
+        weights = self.get_similarity_weights()
+        leaves = np.sort(np.random.default_rng(0).choice(len(packed), max_leaves, replace=False))
+        labels = np.empty(len(packed), dtype=np.int64)
+
+        def fill_tile(start:int, stop:int):
+            block = self.similarity_strategy.get_similarity_from_counts(packed.get_intersections(slice(start, stop), leaves),
+                                                                        packed.popcounts[start:stop, None],
+                                                                        packed.popcounts[None, leaves],
+                                                                        packed.size,
+                                                                        *weights)
+            labels[start:stop] = block.argmax(axis=1)
+
+        fill_row_tiles(len(packed), fill_tile, self.molecule_set.workers)
+        labels[leaves] = np.arange(len(leaves))
+        similarity = self.similarity_strategy.get_similarity_from_counts(packed.get_intersections(leaves, leaves),
+                                                                         packed.popcounts[leaves, None],
+                                                                         packed.popcounts[None, leaves],
+                                                                         packed.size,
+                                                                         *weights)
+        similarity = (similarity + similarity.T) / 2
+        distances = 1 - squareform(similarity, checks=False)
+        return Clustering(hierarchy.linkage(distances, method), distances, leaves, labels, similarity)
+
+    def get_query_result(self, library:ReferenceLibrary, top_k:int):
+        packed = self.molecule_set.get_packed_fingerprints()
+        library_packed = library.get_packed_fingerprints(self.fingerprint_type, self.generation_strategy, self.data, self.molecule_set.workers)
+        if packed.size != library_packed.size:
+            raise ValueError("Query and library fingerprints must have the same length")
+        weights = self.get_similarity_weights()
+        top_k = min(top_k, len(library_packed))
+        hits = np.empty((len(packed), top_k), dtype=np.int64)
+        similarities = np.empty((len(packed), top_k), dtype=np.float64)
+
+        def get_similarity(rows:slice, columns):
+            return self.similarity_strategy.get_similarity_from_counts(packed.get_intersections(rows, columns, library_packed),
+                                                                       packed.popcounts[rows, None],
+                                                                       library_packed.popcounts[None, columns],
+                                                                       packed.size,
+                                                                       *weights)
+
+        def fill_tile(start:int, stop:int):
+            block = get_similarity(slice(start, stop), slice(None))
+            columns = np.argpartition(-block, top_k - 1, axis=1)[:, :top_k]
+            values = np.take_along_axis(block, columns, axis=1)
+            order = np.argsort(-values, axis=1, kind='stable')
+            hits[start:stop] = np.take_along_axis(columns, order, axis=1)
+            similarities[start:stop] = np.take_along_axis(values, order, axis=1)
+
+        fill_row_tiles(len(packed), fill_tile, self.molecule_set.workers, QUERY_BLOCK_SIZE)
+        hit_columns = np.unique(hits)
+        return QueryResult(self.smiles,
+                           np.searchsorted(hit_columns, hits),
+                           similarities,
+                           [library.smiles[i] for i in hit_columns],
+                           [library.identifiers[i] for i in hit_columns],
+                           get_similarity(slice(None), hit_columns))
+
+    def get_similarity_rows(self, start:int, stop:int):
+        if self.similarity_matrix is not None:
+            return dequantize(self.similarity_matrix[start:stop])
+        return self.similarity_engine.generate_similarity_rows(self.molecule_set, self.similarity_strategy, start, stop, self.get_similarity_weights())
+
+    def get_neighbours(self, smiles:str, top_k:int):
+        position = self.molecule_set.get_position(smiles)
+        if position is None:
+            raise KeyError(smiles)
+        row = self.get_similarity_rows(position, position + 1)[0].astype(np.float64)
+        row[position] = -np.inf
+        order = np.argsort(-row, kind='stable')[:min(top_k, len(row) - 1)]
+        return [self.smiles[i] for i in order], row[order]
+
+    def get_cluster_members(self, smiles:str, clustering:Clustering, cluster_count:int):
+        clusters = clustering.get_clusters(cluster_count)
+        position = self.molecule_set.get_position(smiles)
+        if position is None:
+            raise KeyError(smiles)
+        cluster = clusters[position]
+        return [self.smiles[i] for i in np.flatnonzero(clusters == cluster)]
+
+    def get_similarity_tile(self, row_start:int, row_stop:int, column_start:int, column_stop:int, max_size:int, pooling:str="max"):
+        block = self.get_similarity_matrix()[row_start:row_stop, column_start:column_stop]
+        return pool_matrix(block, max_size, pooling)
+
+    def iter_neighbours(self, top_k:int=None, threshold:float=None, tile_size:int=SIMILARITY_BLOCK_SIZE):
+        if threshold is not None and self.similarity_matrix is None and self.similarity_strategy.count_bounded:
+            packed = self.molecule_set.get_packed_fingerprints()
+            index = PopcountIndex(packed)
+            weights = self.get_similarity_weights()
+
+            def get_tile(start:int, stop:int):
+                return index.search(packed, range(start, stop), self.similarity_strategy, threshold, weights, top_k, exclude_self=True)
         else:
-            similarity_matrix = self.similarity_strategy.generate_similarity_matrix(fingerprints)
-        df = pd.DataFrame(similarity_matrix, index=self.smiles, columns=self.smiles)
-        return df.round(2)
+            def get_tile(start:int, stop:int):
+                return select_neighbours(self.get_similarity_rows(start, stop), start, top_k, threshold)
+
+        return iter_row_tiles(len(self.smiles), get_tile, self.molecule_set.workers, tile_size)
+
+    def get_similarity_pairs(self, top_k:int=None, threshold:float=None, max_rows:int=None):
+        rows, columns, values = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        for start, (counts, tile_columns, tile_values) in self.iter_neighbours(top_k, threshold):
+            tile_rows = np.repeat(np.arange(start, start + len(counts)), counts)
+            tile_values = np.round(tile_values, 2)
+            if max_rows is not None and len(values) == max_rows:
+                keep = tile_values > values[-1]
+                tile_rows, tile_columns, tile_values = tile_rows[keep], tile_columns[keep], tile_values[keep]
+            rows, columns, values = np.concatenate([rows, tile_rows]), np.concatenate([columns, tile_columns]), np.concatenate([values, tile_values])
+            if max_rows is not None and len(values) >= max_rows:
+                order = np.argsort(-values, kind='stable')[:max_rows]
+                rows, columns, values = rows[order], columns[order], values[order]
+        order = np.argsort(-values, kind='stable')
+        smiles = np.asarray(self.smiles, dtype=object)
+        return pd.DataFrame({
+            'Molecule 1': smiles[rows[order]],
+            'Molecule 2': smiles[columns[order]],
+            'Similarity': values[order]
+        })
+
+    def get_data_frame(self):
+        similarity_matrix = self.get_similarity_matrix()
+        return pd.DataFrame(similarity_matrix, index=self.smiles, columns=self.smiles, copy=False)
     
-    def get_molecule_image(self, smiles:str):
-        mol = Chem.MolFromSmiles(smiles)
-        canvas = Draw.MolDraw2DCairo(1000, 1000)
+    def get_molecule_image(self, smiles:str, size:tuple=MOLECULE_IMAGE_SIZE, image_format:str=MOLECULE_IMAGE_FORMAT):
+        mol = self.molecule_set.get_molecule(smiles)
+        canvas = get_drawing_canvas(size, image_format)
         canvas.DrawMolecule(mol)
         canvas.FinishDrawing()
-        bio = io.BytesIO(canvas.GetDrawingText())
-        image = Image.open(bio)
-        return image
-    
-    def get_fingerprint_indices(self):
-        fingerprints = self.generation_strategy.generate_fingerprints(self.molecules, self.data)
-        fingerprint_dict = dict()
-        for i, fingerprint in enumerate(fingerprints):
-            fingerprint_on_bits = list(fingerprint.GetOnBits())
-            fingerprint_dict[self.smiles[i]] = fingerprint_on_bits
-        return fingerprint_dict
+        return encode_drawing(canvas.GetDrawingText(), image_format)
     
+    def get_molecule_grid(self, smiles:list, legends:list=None, molecules_per_row:int=GRID_COLUMNS, size:tuple=GRID_IMAGE_SIZE, image_format:str=GRID_IMAGE_FORMAT):
+        molecules = [self.molecule_set.get_molecule(x) for x in smiles]
+        if image_format == 'svg':
+            drawing = Draw.MolsToGridImage(molecules, molsPerRow=molecules_per_row, subImgSize=size, legends=legends, useSVG=True)
+            return encode_drawing(drawing, image_format)
+        image = Draw.MolsToGridImage(molecules, molsPerRow=molecules_per_row, subImgSize=size, legends=legends)
+        return encode_image(image, image_format)
+
     def get_fingerprint_bit_image(self, smiles:str, bit: str):
-        mol = Chem.MolFromSmiles(smiles)
+        mol = self.molecule_set.get_molecule(smiles)
 
         if isinstance(self.generation_strategy, MorganFingerprintGenerator):
-            fpgen = self.generation_strategy.get_fingerprint_generator(self.data)
-            ao = AllChem.AdditionalOutput()
-            ao.CollectBitInfoMap()
-            fp = fpgen.GetFingerprint(mol, additionalOutput=ao)
-            bi = ao.GetBitInfoMap()
+            bi = self.molecule_set.get_bit_info(smiles)
             image = Draw.DrawMorganBit(mol, int(bit), bi, useSVG=True)
-            svg_bytes = image.encode('utf-8')
-            encoded = base64.b64encode(svg_bytes).decode('utf-8')
-            return f"data:image/svg+xml;base64,{encoded}"
+            return encode_drawing(image, 'svg')
         elif isinstance(self.generation_strategy, RDKitFingerprintGenerator):
-            fpgen = self.generation_strategy.get_fingerprint_generator(self.data)
-            ao = AllChem.AdditionalOutput()
-            ao.CollectBitPaths()
-            fp = fpgen.GetFingerprint(mol, additionalOutput=ao)
-            bi = ao.GetBitPaths()
+            bi = self.molecule_set.get_bit_info(smiles)
             image = Draw.DrawRDKitBit(mol, int(bit), bi, useSVG=True)
-            svg_bytes = image.encode('utf-8')
-            encoded = base64.b64encode(svg_bytes).decode('utf-8')
-            return f"data:image/svg+xml;base64,{encoded}"
+            return encode_drawing(image, 'svg')
         else:
             raise ValueError("Fingerprint bit images can be only generated for RDKit and Morgan fingerprints.")
         
@@ -262,19 +1031,15 @@ class DataFrameGenerator:
         elif isinstance(self.similarity_strategy, McConnaugheyStrategy):
             return DataStructs.McConnaugheySimilarity
         
-    def get_similarity_map(self, smiles1:str, smiles2:str):
-        canvas = Draw.MolDraw2DCairo(800, 550)
-        mol1 = Chem.MolFromSmiles(smiles1)
-        mol2 = Chem.MolFromSmiles(smiles2) 
+    def get_similarity_map(self, smiles1:str, smiles2:str, size:tuple=SIMILARITY_MAP_SIZE, image_format:str=SIMILARITY_MAP_FORMAT):
+        canvas = get_drawing_canvas(size, image_format)
+        mol1 = self.molecule_set.get_molecule(smiles1)
+        mol2 = self.molecule_set.get_molecule(smiles2)
         if isinstance(self.generation_strategy, AtomPairsFingerprintGenerator):
             _, maxweight = SimilarityMaps.GetSimilarityMapForFingerprint(mol1, mol2, lambda m, idx: SimilarityMaps.GetAPFingerprint(m, atomId=idx, fpType='bv'), canvas, metric=self.get_similarity_metric())
             canvas.FinishDrawing()
-            bio = io.BytesIO(canvas.GetDrawingText())
-            image = Image.open(bio)
-            return image
+            return encode_drawing(canvas.GetDrawingText(), image_format)
         elif isinstance(self.generation_strategy, MorganFingerprintGenerator):
-            _, maxweight = SimilarityMaps.GetSimilarityMapForFingerprint(mol1, mol2, lambda m, idx: SimilarityMaps.GetMorganFingerprint(m, atomId=idx, fpType='bv', radius=int(self.data['radius'])), canvas, metric=self.get_similarity_metric())
+            _, maxweight = SimilarityMaps.GetSimilarityMapForFingerprint(mol1, mol2, lambda m, idx: SimilarityMaps.GetMorganFingerprint(m, atomId=idx, fpType='bv', radius=int(self.molecule_set.data['radius'])), canvas, metric=self.get_similarity_metric())
             canvas.FinishDrawing()
-            bio = io.BytesIO(canvas.GetDrawingText())
-            image = Image.open(bio)
-            return image
\ No newline at end of file
+            return encode_drawing(canvas.GetDrawingText(), image_format)
\ No newline at end of file
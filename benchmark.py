@@ -0,0 +1,107 @@
+import argparse
+import os
+import time
+import numpy as np
+from rdkit import Chem, DataStructs, RDConfig
+from algorithms import (FINGERPRINT_PARAMETERS, SIMILARITY_STRATEGIES, DataFrameGenerator, MoleculeSet, NumpySimilarityEngine, PackedFingerprints,
+                        PopcountIndex, RDKitSimilarityEngine, TanimotoStrategy, get_generation_strategy)
+from ingestion import read_records
+
+DEFAULT_LIBRARY = os.path.join(RDConfig.RDDataDir, 'NCI', 'first_5K.smi')
+DEFAULT_THRESHOLDS = [0.6, 0.7, 0.8, 0.9]
+CHECK_TVERSKY_WEIGHTS = [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (0.5, 0.5), (0.2, 0.8), (1.0, 1.0)]
+CHECK_TOLERANCE = 1e-12
+
+def get_best_time(function, repeats:int):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def search_bulk(queries:list, fingerprints:list, threshold:float):
+    hits = 0
+    for query in queries:
+        hits += int((np.asarray(DataStructs.BulkTanimotoSimilarity(query, fingerprints)) >= threshold).sum())
+    return hits
+
+def search_index(index:PopcountIndex, queries:PackedFingerprints, threshold:float):
+    counts, _, _ = index.search(queries, range(len(queries)), TanimotoStrategy(), threshold)
+    return int(counts.sum())
+
+def check_engines(data_frame_generator:DataFrameGenerator, rows:int, thresholds:list):
+    molecule_set = data_frame_generator.molecule_set
+    index = PopcountIndex(molecule_set.get_packed_fingerprints())
+    checked = 0
+    for name in SIMILARITY_STRATEGIES:
+        similarity_strategy = data_frame_generator.get_similarity_strategy(name)
+        for weights in CHECK_TVERSKY_WEIGHTS if name == "Tversky" else [()]:
+            expected = RDKitSimilarityEngine().generate_similarity_rows(molecule_set, similarity_strategy, 0, rows, weights)
+            actual = NumpySimilarityEngine().generate_similarity_rows(molecule_set, similarity_strategy, 0, rows, weights)
+            mismatches = int((np.abs(expected - actual) > CHECK_TOLERANCE).sum())
+            if mismatches:
+                raise RuntimeError(f"{name}{list(weights) if weights else ''}: {mismatches} of {expected.size} similarities differ between the RDKit and NumPy engines")
+            if similarity_strategy.count_bounded:
+                for threshold in thresholds:
+                    counts, _, _ = index.search(molecule_set.get_packed_fingerprints(), range(rows), similarity_strategy, threshold, weights)
+                    hits = int((actual >= threshold).sum())
+                    if int(counts.sum()) != hits:
+                        raise RuntimeError(f"{name}{list(weights) if weights else ''}: the index finds {int(counts.sum())} hits at threshold {threshold}, a full scan {hits}")
+            checked += 1
+    return checked
+
+def main(arguments:list=None):
+    parser = argparse.ArgumentParser(description="Compare popcount-pruned threshold search against RDKit BulkTanimotoSimilarity.")
+    parser.add_argument('library', nargs='?', default=DEFAULT_LIBRARY, help="SMILES, CSV or SDF file to search, defaults to the NCI sample shipped with RDKit")
+    parser.add_argument('--fingerprint-type', choices=list(FINGERPRINT_PARAMETERS), default="Morgan")
+    parser.add_argument('--radius', type=int, default=2)
+    parser.add_argument('--fps-morgan', type=int, default=2048)
+    parser.add_argument('--min-path', type=int, default=1)
+    parser.add_argument('--max-path', type=int, default=7)
+    parser.add_argument('--fps-rdkit', type=int, default=2048)
+    parser.add_argument('--fps-atompairs', type=int, default=2048)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-check', action='store_true', help="skip comparing the RDKit and NumPy engines and the index for every similarity metric")
+    args = parser.parse_args(arguments)
+
+    data = {
+        'min_path': args.min_path,
+        'max_path': args.max_path,
+        'fps_rdkit': args.fps_rdkit,
+        'fps_atompairs': args.fps_atompairs,
+        'radius': args.radius,
+        'fps_morgan': args.fps_morgan
+    }
+    molecules = [(x, Chem.MolFromSmiles(x) if x else None) for x, _ in read_records(args.library)]
+    smiles, molecules = zip(*[(x, molecule) for x, molecule in molecules if molecule is not None])
+    molecule_set = MoleculeSet(list(smiles), get_generation_strategy(args.fingerprint_type), data, list(molecules), workers=1)
+    fingerprints = molecule_set.get_fingerprints()
+    packed = molecule_set.get_packed_fingerprints()
+
+    positions = np.random.default_rng(args.seed).choice(len(fingerprints), min(args.queries, len(fingerprints)), replace=False)
+    query_fingerprints = [fingerprints[i] for i in positions]
+    queries = PackedFingerprints.from_words(packed.words[positions], packed.size, packed.popcounts[positions])
+    if not args.skip_check:
+        data_frame_generator = DataFrameGenerator(list(smiles), args.fingerprint_type, "Tanimoto", data, molecule_set=molecule_set)
+        checked = check_engines(data_frame_generator, len(positions), args.thresholds)
+        print(f"RDKit and NumPy engines and the index agree on {checked} similarity settings")
+    build_time, index = get_best_time(lambda: PopcountIndex(packed), args.repeats)
+
+    print(f"{len(fingerprints)} {args.fingerprint_type} fingerprints, {len(positions)} queries, index built in {build_time * 1000:.1f} ms")
+    print(f"{'threshold':>9} {'hits':>8} {'scanned':>8} {'bulk ms':>9} {'index ms':>9} {'speedup':>8}")
+    for threshold in args.thresholds:
+        bulk_time, bulk_hits = get_best_time(lambda: search_bulk(query_fingerprints, fingerprints, threshold), args.repeats)
+        index_time, index_hits = get_best_time(lambda: search_index(index, queries, threshold), args.repeats)
+        if bulk_hits != index_hits:
+            raise RuntimeError(f"Hit counts differ at threshold {threshold}: {bulk_hits} from RDKit, {index_hits} from the index")
+        starts, stops = index.get_candidate_ranges(queries.popcounts, TanimotoStrategy(), threshold)
+        scanned = (stops - starts).sum() / (len(queries) * len(index))
+        print(f"{threshold:>9.2f} {bulk_hits:>8} {scanned:>8.1%} {bulk_time * 1000:>9.1f} {index_time * 1000:>9.1f} {bulk_time / index_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tempfile
+import threading
+from copy import copy
+from collections import OrderedDict
+import diskcache
+from algorithms import FINGERPRINT_PARAMETERS, MoleculeSet
+
+MOLECULE_CACHE_ENTRIES = 16
+MOLECULE_CACHE_BYTES = 512 * 1024 * 1024
+RESULT_CACHE_ENTRIES = 16
+RESULT_CACHE_BYTES = 1024 * 1024 * 1024
+LIBRARY_CACHE_ENTRIES = 4
+LIBRARY_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+IMAGE_CACHE_ENTRIES = 1024
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+IMAGE_DISK_CACHE = True
+CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'molecular-similarity-visualiser')
+DISK_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+UPLOAD_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'uploads')
+
+class LRUCache:
+    def __init__(self, max_entries:int, max_bytes:int, disk_cache:diskcache.Cache=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key:str):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.disk_cache is None:
+            return None
+        value = self.disk_cache.get(key)
+        if value is not None:
+            with self.lock:
+                self.entries[key] = value
+                self.evict()
+        return value
+
+    def put(self, key:str, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.evict()
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value)
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        while len(self.entries) > 1 and self.get_size() > self.max_bytes:
+            self.entries.popitem(last=False)
+
+    def get_size(self):
+        return sum(value.get_size() for value in self.entries.values())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+
+    def __contains__(self, key:str):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+class SubmitResult:
+    def __init__(self, data_frame_generator, options:dict, query_result=None, session_key:str=None, identifiers:list=None):
+        self.data_frame_generator = data_frame_generator
+        self.options = options
+        self.query_result = query_result
+        self.session_key = session_key
+        self.identifiers = identifiers
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.session_key is not None:
+            data_frame_generator = copy(self.data_frame_generator)
+            data_frame_generator.molecule_set = None
+            data_frame_generator.molecules = None
+            state['data_frame_generator'] = data_frame_generator
+        return state
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        data_frame_generator = self.data_frame_generator
+        if data_frame_generator.molecule_set is None:
+            molecule_set = molecule_cache.get(self.session_key)
+            if molecule_set is None:
+                molecule_set = MoleculeSet(data_frame_generator.smiles, data_frame_generator.generation_strategy, data_frame_generator.data)
+                molecule_cache.put(self.session_key, molecule_set)
+            data_frame_generator.molecule_set = molecule_set
+            data_frame_generator.molecules = molecule_set.molecules
+
+    def get_size(self):
+        size = self.data_frame_generator.get_size() + self.data_frame_generator.molecule_set.get_size()
+        if self.identifiers is not None:
+            size += sum(len(x) for x in self.identifiers)
+        if self.query_result is not None:
+            size += self.query_result.get_size()
+        return size
+
+class RenderedImage:
+    def __init__(self, data_uri:str):
+        self.data_uri = data_uri
+
+    def get_size(self):
+        return len(self.data_uri)
+
+def get_fingerprint_parameters(fingerprint_type:str, data:dict):
+    return tuple((name, data.get(name)) for name in FINGERPRINT_PARAMETERS[fingerprint_type])
+
+def get_session_key(smiles:list, fingerprint_type:str, data:dict):
+    key = repr((tuple(smiles), fingerprint_type, get_fingerprint_parameters(fingerprint_type, data)))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def get_result_key(session_key:str, *options):
+    key = repr((session_key,) + options)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def get_image_key(*parts):
+    key = repr(parts)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def get_disk_cache(name:str, size_limit:int=DISK_CACHE_BYTES):
+    return diskcache.Cache(os.path.join(CACHE_DIRECTORY, name), size_limit=size_limit)
+
+job_cache = get_disk_cache('jobs')
+molecule_cache = LRUCache(MOLECULE_CACHE_ENTRIES, MOLECULE_CACHE_BYTES, get_disk_cache('molecules'))
+result_cache = LRUCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES, get_disk_cache('results'))
+library_cache = LRUCache(LIBRARY_CACHE_ENTRIES, LIBRARY_CACHE_BYTES, get_disk_cache('library'))
+image_cache = LRUCache(IMAGE_CACHE_ENTRIES, IMAGE_CACHE_BYTES, get_disk_cache('images') if IMAGE_DISK_CACHE else None)
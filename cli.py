@@ -0,0 +1,130 @@
+import argparse
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+from algorithms import (APPROXIMATE_CLUSTERING_LEAVES, FINGERPRINT_PARAMETERS, LINKAGE_METHODS, SIMILARITY_BLOCK_SIZE, SIMILARITY_STRATEGIES,
+                        DataFrameGenerator, get_generation_strategy)
+from export import PAIR_FORMATS, open_pair_writer
+from ingestion import INGESTION_CHUNK_SIZE, parse_file
+
+ROW_BYTES_PER_MOLECULE = 32
+MAX_TILE_SIZE = 1024
+MEMORY_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_memory_limit(value:str):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*', value.upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Invalid memory limit: {value}, expected e.g. 512M or 4G")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+def get_available_memory(memory_limit:int, data_frame_generator:DataFrameGenerator):
+    if memory_limit is None:
+        return None
+    return memory_limit - data_frame_generator.molecule_set.get_size() - data_frame_generator.get_size()
+
+def get_tile_size(molecule_count:int, workers:int, available_memory:int):
+    if available_memory is None:
+        return SIMILARITY_BLOCK_SIZE
+    rows = available_memory // (ROW_BYTES_PER_MOLECULE * max(molecule_count, 1) * 2 * workers)
+    return int(max(1, min(rows, MAX_TILE_SIZE)))
+
+def get_exact_clustering_size(molecule_count:int, similarity_dtype:str):
+    return molecule_count * molecule_count * np.dtype(similarity_dtype).itemsize + molecule_count * (molecule_count - 1) // 2 * 8
+
+def log(message:str, start:float):
+    print(f"[{time.perf_counter() - start:8.1f}s] {message}", flush=True)
+
+def main(arguments:list=None):
+    parser = argparse.ArgumentParser(description="Compute nearest-neighbour similarity pairs and clusters for a file of molecules without starting the web app.")
+    parser.add_argument('input', help="SMILES (.smi, one 'SMILES [ID]' per line), CSV with a SMILES column or SDF file, optionally gzipped")
+    parser.add_argument('output', help=f"pairs file, the format follows the extension ({', '.join('.' + x for x in PAIR_FORMATS)})")
+    parser.add_argument('--fingerprint-type', choices=list(FINGERPRINT_PARAMETERS), default="Morgan")
+    parser.add_argument('--min-path', type=int, default=1)
+    parser.add_argument('--max-path', type=int, default=2)
+    parser.add_argument('--fps-rdkit', type=int, default=2048)
+    parser.add_argument('--fps-atompairs', type=int, default=2048)
+    parser.add_argument('--radius', type=int, default=1)
+    parser.add_argument('--fps-morgan', type=int, default=2048)
+    parser.add_argument('--similarity', choices=SIMILARITY_STRATEGIES, default="Tanimoto")
+    parser.add_argument('--tversky-a', type=float, default=None)
+    parser.add_argument('--tversky-b', type=float, default=None)
+    parser.add_argument('--engine', choices=["RDKit", "NumPy"], default="NumPy")
+    parser.add_argument('--top-k', type=int, default=10, help="neighbours kept per molecule, 0 keeps every pair above the threshold")
+    parser.add_argument('--threshold', type=float, default=None)
+    parser.add_argument('--clusters', type=int, default=None, help="also cut the hierarchical clustering into this many clusters")
+    parser.add_argument('--linkage', choices=LINKAGE_METHODS, default="complete")
+    parser.add_argument('--approximate-clustering', action='store_true', help=f"cluster {APPROXIMATE_CLUSTERING_LEAVES} sampled molecules and assign the rest to their nearest sample")
+    parser.add_argument('--molecules-output', default=None, help="molecule index (and clusters) CSV, defaults to <output>.molecules.csv")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--memory-limit', type=parse_memory_limit, default=None, help="approximate memory budget, e.g. 4G, used to size row blocks and to fall back to approximate clustering")
+    parser.add_argument('--chunk-size', type=int, default=INGESTION_CHUNK_SIZE)
+    args = parser.parse_args(arguments)
+
+    if args.similarity == "Tversky" and (args.tversky_a is None or args.tversky_b is None):
+        parser.error("--tversky-a and --tversky-b are required for Tversky similarity")
+    if args.top_k < 0:
+        parser.error("--top-k must not be negative")
+    if not args.top_k and args.threshold is None:
+        parser.error("--threshold is required when --top-k is 0")
+
+    start = time.perf_counter()
+    data = {
+        'min_path': args.min_path,
+        'max_path': args.max_path,
+        'fps_rdkit': args.fps_rdkit,
+        'fps_atompairs': args.fps_atompairs,
+        'radius': args.radius,
+        'fps_morgan': args.fps_morgan,
+        'a': args.tversky_a,
+        'b': args.tversky_b
+    }
+    generation_strategy = get_generation_strategy(args.fingerprint_type) if args.engine == "NumPy" else None
+    parsed_input = parse_file(args.input, args.chunk_size, generation_strategy, data, args.workers)
+    log(f"Parsed {len(parsed_input.smiles)} molecules ({len(parsed_input.invalid)} invalid, {len(parsed_input.duplicates)} duplicates skipped)", start)
+    if len(parsed_input.smiles) < 2:
+        raise SystemExit("There must be at least 2 distinct valid molecules")
+
+    data_frame_generator = DataFrameGenerator(smiles=parsed_input.smiles,
+                                              generation_strategy=args.fingerprint_type,
+                                              similarity_strategy=args.similarity,
+                                              data=data,
+                                              molecules=parsed_input.molecules,
+                                              similarity_engine=args.engine,
+                                              workers=args.workers,
+                                              packed_fingerprints=parsed_input.packed_fingerprints)
+    if parsed_input.packed_fingerprints is None:
+        data_frame_generator.get_fingerprints()
+    molecule_count = len(parsed_input.smiles)
+    workers = data_frame_generator.molecule_set.workers
+    log(f"Generated {args.fingerprint_type} fingerprints with {workers} workers", start)
+
+    molecules = pd.DataFrame({'Index': np.arange(molecule_count), 'SMILES': parsed_input.smiles, 'ID': parsed_input.identifiers})
+    if args.clusters is not None:
+        approximate = args.approximate_clustering
+        available_memory = get_available_memory(args.memory_limit, data_frame_generator)
+        if not approximate and available_memory is not None and get_exact_clustering_size(molecule_count, "float64") > available_memory:
+            approximate = True
+            log(f"Exact clustering of {molecule_count} molecules does not fit the memory limit, clustering approximately", start)
+        clustering = data_frame_generator.get_clustering(args.linkage, approximate)
+        molecules['Cluster'] = clustering.get_clusters(args.clusters)
+        log(f"Clustered into {args.clusters} clusters with {args.linkage} linkage", start)
+
+    molecules_output = args.molecules_output if args.molecules_output is not None else f"{args.output}.molecules.csv"
+    os.makedirs(os.path.dirname(os.path.abspath(molecules_output)), exist_ok=True)
+    molecules.to_csv(molecules_output, index=False)
+
+    tile_size = get_tile_size(molecule_count, workers, get_available_memory(args.memory_limit, data_frame_generator))
+    writer = open_pair_writer(args.output, parsed_input.smiles, parsed_input.identifiers)
+    pair_count = 0
+    try:
+        for tile_start, (counts, columns, values) in data_frame_generator.iter_neighbours(args.top_k or None, args.threshold, tile_size):
+            writer.write(tile_start, counts, columns, values)
+            pair_count += len(columns)
+    finally:
+        writer.close()
+    log(f"Wrote {pair_count} {args.similarity} pairs to {args.output} and the molecule index to {molecules_output}", start)
+
+if __name__ == '__main__':
+    main()
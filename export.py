@@ -0,0 +1,174 @@
+import gzip
+import io
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+from algorithms import SIMILARITY_BLOCK_SIZE
+from fingerprint_database import write_npy
+from transport import COMPRESSION_LEVEL
+
+PAIR_FORMATS = ['csv', 'csv.gz', 'parquet', 'npy']
+STREAM_FORMATS = {
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet'
+}
+EXPORT_BLOCK_PAIRS = 100000
+PAIR_DTYPE = np.dtype([('row', np.int64), ('column', np.int64), ('similarity', np.float64)])
+PARQUET_COMPRESSION = 'zstd'
+
+def get_pair_format(path:str):
+    for pair_format in sorted(PAIR_FORMATS, key=len, reverse=True):
+        if path.lower().endswith(f".{pair_format}"):
+            return pair_format
+    raise ValueError(f"Unknown pair format for {path}, expected one of {', '.join('.' + x for x in PAIR_FORMATS)}")
+
+def get_pair_rows(start:int, counts:np.ndarray):
+    return np.repeat(np.arange(start, start + len(counts)), counts)
+
+def get_export_tile_size(molecule_count:int, top_k:int=None, max_tile_size:int=SIMILARITY_BLOCK_SIZE):
+    pairs_per_row = min(top_k, molecule_count) if top_k else molecule_count
+    return int(max(1, min(EXPORT_BLOCK_PAIRS // max(pairs_per_row, 1), max_tile_size)))
+
+class StreamBuffer(io.RawIOBase):
+    def __init__(self):
+        self.blocks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.blocks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.blocks)
+        self.blocks.clear()
+        return data
+
+class PairWriter(ABC):
+    @abstractmethod
+    def write(self, start:int, counts:np.ndarray, columns:np.ndarray, values:np.ndarray):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+class TablePairWriter(PairWriter):
+    def __init__(self, file, smiles:list, identifiers:list=None):
+        self.file = file
+        self.smiles = np.asarray(smiles, dtype=object)
+        self.identifiers = np.asarray(identifiers, dtype=object) if identifiers is not None else None
+
+    def get_block(self, start:int, counts:np.ndarray, columns:np.ndarray, values:np.ndarray):
+        rows = get_pair_rows(start, counts)
+        block = {'Molecule 1': self.smiles[rows], 'Molecule 2': self.smiles[columns]}
+        if self.identifiers is not None:
+            block['ID 1'] = self.identifiers[rows]
+            block['ID 2'] = self.identifiers[columns]
+        block['Similarity'] = values
+        return pd.DataFrame(block)
+
+    def write(self, start:int, counts:np.ndarray, columns:np.ndarray, values:np.ndarray):
+        self.write_block(self.get_block(start, counts, columns, values))
+
+    def get_empty_block(self):
+        return self.get_block(0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    @abstractmethod
+    def write_block(self, block:pd.DataFrame):
+        pass
+
+class CSVPairWriter(TablePairWriter):
+    def __init__(self, file, smiles:list, identifiers:list=None, compress:bool=False):
+        super().__init__(file, smiles, identifiers)
+        self.output = gzip.GzipFile(fileobj=file, mode='wb', compresslevel=COMPRESSION_LEVEL) if compress else file
+        self.header = True
+
+    def write_block(self, block:pd.DataFrame):
+        self.output.write(block.to_csv(header=self.header, index=False).encode('utf-8'))
+        self.header = False
+
+    def close(self):
+        if self.header:
+            self.write_block(self.get_empty_block())
+        if self.output is not self.file:
+            self.output.close()
+        self.file.close()
+
+class ParquetPairWriter(TablePairWriter):
+    def __init__(self, file, smiles:list, identifiers:list=None):
+        super().__init__(file, smiles, identifiers)
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.writer = None
+
+    def write_block(self, block:pd.DataFrame):
+        table = self.pyarrow.Table.from_pandas(block, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.file, table.schema, compression=PARQUET_COMPRESSION)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            self.write_block(self.get_empty_block())
+        self.writer.close()
+        self.file.close()
+
+class NPYPairWriter(PairWriter):
+    def __init__(self, path:str):
+        self.path = path
+        self.raw_path = f"{path}.raw"
+        self.file = open(self.raw_path, 'wb')
+        self.count = 0
+
+    def write(self, start:int, counts:np.ndarray, columns:np.ndarray, values:np.ndarray):
+        block = np.empty(len(columns), dtype=PAIR_DTYPE)
+        block['row'] = get_pair_rows(start, counts)
+        block['column'] = columns
+        block['similarity'] = values
+        self.file.write(block.tobytes())
+        self.count += len(block)
+
+    def close(self):
+        self.file.close()
+        write_npy(self.path, self.raw_path, PAIR_DTYPE, (self.count,))
+
+def get_pair_writer(file, pair_format:str, smiles:list, identifiers:list=None):
+    if pair_format == 'parquet':
+        return ParquetPairWriter(file, smiles, identifiers)
+    elif pair_format in ('csv', 'csv.gz'):
+        return CSVPairWriter(file, smiles, identifiers, compress=pair_format == 'csv.gz')
+    else:
+        raise ValueError(f"Pair format {pair_format} cannot be written to a stream")
+
+def open_pair_writer(path:str, smiles:list, identifiers:list=None, pair_format:str=None):
+    pair_format = pair_format if pair_format is not None else get_pair_format(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if pair_format == 'npy':
+        return NPYPairWriter(path)
+    return get_pair_writer(open(path, 'wb'), pair_format, smiles, identifiers)
+
+def stream_pairs(tiles, pair_format:str, smiles:list, identifiers:list=None):
+    buffer = StreamBuffer()
+    writer = get_pair_writer(buffer, pair_format, smiles, identifiers)
+    for start, (counts, columns, values) in tiles:
+        writer.write(start, counts, columns, values)
+        data = buffer.drain()
+        if data:
+            yield data
+    writer.close()
+    yield buffer.drain()
+
+def stream_pair_table(pairs:pd.DataFrame, pair_format:str):
+    buffer = StreamBuffer()
+    writer = get_pair_writer(buffer, pair_format, [])
+    for start in range(0, len(pairs), EXPORT_BLOCK_PAIRS):
+        writer.write_block(pairs.iloc[start:start + EXPORT_BLOCK_PAIRS])
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
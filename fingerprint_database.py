@@ -0,0 +1,133 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import shutil
+import numpy as np
+from algorithms import FINGERPRINT_PARAMETERS, LIBRARY_CHUNK_SIZE, PackedFingerprints, ReferenceLibrary, get_generation_strategy, pack_fingerprints
+from ingestion import read_chunks, read_records
+
+INDEX_COLUMNS = ('smiles', 'identifiers')
+
+class StringColumn:
+    def __init__(self, path:str):
+        self.offsets = np.load(f"{path}.offsets.npy", mmap_mode='r')
+        self.file = open(f"{path}.txt", 'rb')
+        self.text = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if len(self) else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        key = int(key)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("StringColumn index out of range")
+        return self.text[self.offsets[key]:self.offsets[key + 1] - 1].decode('utf-8')
+
+class StringColumnWriter:
+    def __init__(self, path:str):
+        self.path = path
+        self.file = open(f"{path}.txt", 'wb')
+        self.offsets = [0]
+
+    def write(self, values:list):
+        for value in values:
+            line = ((value or "").replace("\n", " ") + "\n").encode('utf-8')
+            self.file.write(line)
+            self.offsets.append(self.offsets[-1] + len(line))
+
+    def close(self):
+        self.file.close()
+        np.save(f"{self.path}.offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+
+def get_fingerprint_set_name(fingerprint_type:str, data:dict):
+    parameters = [f"{name}-{data.get(name)}" for name in FINGERPRINT_PARAMETERS[fingerprint_type]]
+    return "_".join([fingerprint_type.lower().replace(" ", "-")] + parameters)
+
+def write_npy(path:str, raw_path:str, dtype:type, shape:tuple):
+    with open(path, 'wb') as file, open(raw_path, 'rb') as raw:
+        np.lib.format.write_array_header_1_0(file, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': shape})
+        shutil.copyfileobj(raw, file)
+    os.remove(raw_path)
+
+def build_fingerprint_database(input_path:str, directory:str, fingerprint_type:str, data:dict, workers:int=None, chunk_size:int=LIBRARY_CHUNK_SIZE):
+    os.makedirs(directory, exist_ok=True)
+    generation_strategy = get_generation_strategy(fingerprint_type)
+    name = os.path.join(directory, get_fingerprint_set_name(fingerprint_type, data))
+    index_exists = os.path.exists(os.path.join(directory, f"{INDEX_COLUMNS[0]}.offsets.npy"))
+    writers = [] if index_exists else [StringColumnWriter(os.path.join(directory, column)) for column in INDEX_COLUMNS]
+    count = 0
+    size = 0
+    width = 0
+    with open(f"{name}.words.raw", 'wb') as words_file, open(f"{name}.popcounts.raw", 'wb') as popcounts_file:
+        for chunk in read_chunks(read_records(input_path), chunk_size):
+            packed = pack_fingerprints([smiles for smiles, _ in chunk], generation_strategy, data, workers)
+            words_file.write(packed.words.tobytes())
+            popcounts_file.write(packed.popcounts.tobytes())
+            for writer, values in zip(writers, zip(*chunk)):
+                writer.write(values)
+            count += len(chunk)
+            size, width = packed.size, packed.words.shape[1]
+    for writer in writers:
+        writer.close()
+
+    if index_exists and count != len(StringColumn(os.path.join(directory, INDEX_COLUMNS[0]))):
+        raise ValueError(f"{input_path} does not match the molecules already indexed in {directory}")
+
+    write_npy(f"{name}.words.npy", f"{name}.words.raw", np.uint64, (count, width))
+    write_npy(f"{name}.popcounts.npy", f"{name}.popcounts.raw", np.int64, (count,))
+    with open(f"{name}.json", 'w') as file:
+        json.dump({
+            'fingerprint_type': fingerprint_type,
+            'parameters': {parameter: data.get(parameter) for parameter in FINGERPRINT_PARAMETERS[fingerprint_type]},
+            'size': size,
+            'count': count
+        }, file, indent=2)
+    return count
+
+def open_fingerprint_database(directory:str, cache=None):
+    smiles, identifiers = (StringColumn(os.path.join(directory, column)) for column in INDEX_COLUMNS)
+    library = ReferenceLibrary(smiles, identifiers, os.path.abspath(directory), cache)
+    for metadata_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+        name = metadata_path[:-len(".json")]
+        words = np.load(f"{name}.words.npy", mmap_mode='r')
+        popcounts = np.load(f"{name}.popcounts.npy", mmap_mode='r')
+        key = library.get_fingerprint_key(metadata['fingerprint_type'], metadata['parameters'])
+        library.packed_fingerprints[key] = PackedFingerprints.from_words(words, metadata['size'], popcounts)
+    return library
+
+def main(arguments:list=None):
+    parser = argparse.ArgumentParser(description="Build an on-disk fingerprint database for searching a reference library.")
+    parser.add_argument('input', help="SMILES (.smi, one 'SMILES [ID]' per line), CSV with a SMILES column or SDF file, optionally gzipped")
+    parser.add_argument('output', help="database directory, one fingerprint set is added per run")
+    parser.add_argument('--fingerprint-type', choices=list(FINGERPRINT_PARAMETERS), default="Morgan")
+    parser.add_argument('--min-path', type=int, default=1)
+    parser.add_argument('--max-path', type=int, default=2)
+    parser.add_argument('--fps-rdkit', type=int, default=2048)
+    parser.add_argument('--fps-atompairs', type=int, default=2048)
+    parser.add_argument('--radius', type=int, default=1)
+    parser.add_argument('--fps-morgan', type=int, default=2048)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=LIBRARY_CHUNK_SIZE)
+    args = parser.parse_args(arguments)
+
+    data = {
+        'min_path': args.min_path,
+        'max_path': args.max_path,
+        'fps_rdkit': args.fps_rdkit,
+        'fps_atompairs': args.fps_atompairs,
+        'radius': args.radius,
+        'fps_morgan': args.fps_morgan
+    }
+    count = build_fingerprint_database(args.input, args.output, args.fingerprint_type, data, args.workers, args.chunk_size)
+    print(f"Wrote {count} {args.fingerprint_type} fingerprints to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import base64
+import csv
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import time
+from rdkit import Chem
+from algorithms import FingerprintGenerator, MoleculeSet, PackedFingerprints, ParsedInput, parse_smiles
+
+INGESTION_CHUNK_SIZE = 10000
+UPLOAD_DECODE_BLOCK = 4 * 1024 * 1024
+UPLOAD_MAX_AGE = 24 * 60 * 60
+INPUT_FORMATS = ['.smi', '.smiles', '.txt', '.csv', '.sdf']
+SMILES_COLUMNS = ('smiles', 'canonical_smiles')
+IDENTIFIER_COLUMNS = ('id', 'identifier', 'name', 'title')
+
+def get_input_format(path:str):
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    extension = os.path.splitext(name)[1]
+    if extension not in INPUT_FORMATS:
+        raise ValueError(f"Unsupported file type: {os.path.basename(path)}, expected one of {', '.join(INPUT_FORMATS)} (optionally gzipped)")
+    return extension
+
+def read_smiles_records(file):
+    for line in file:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        yield fields[0], fields[1] if len(fields) > 1 else fields[0]
+
+def read_csv_records(file):
+    reader = csv.reader(file)
+    header = [x.strip().lower() for x in next(reader, [])]
+    smiles_column = next((header.index(x) for x in SMILES_COLUMNS if x in header), None)
+    if smiles_column is None:
+        raise ValueError(f"CSV files need a header with a {' or '.join(SMILES_COLUMNS)} column")
+    identifier_column = next((header.index(x) for x in IDENTIFIER_COLUMNS if x in header), None)
+    for row in reader:
+        if len(row) <= smiles_column or not row[smiles_column].strip():
+            continue
+        smiles = row[smiles_column].strip()
+        identifier = row[identifier_column].strip() if identifier_column is not None and len(row) > identifier_column else ""
+        yield smiles, identifier or smiles
+
+def read_sdf_records(file):
+    for molecule in Chem.ForwardSDMolSupplier(file):
+        if molecule is None:
+            yield None, ""
+            continue
+        smiles = Chem.MolToSmiles(molecule)
+        yield smiles, molecule.GetProp('_Name') if molecule.HasProp('_Name') and molecule.GetProp('_Name') else smiles
+
+def read_records(path:str):
+    input_format = get_input_format(path)
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    if input_format == '.sdf':
+        with opener(path, 'rb') as file:
+            yield from read_sdf_records(file)
+    elif input_format == '.csv':
+        with opener(path, 'rt', newline='') as file:
+            yield from read_csv_records(file)
+    else:
+        with opener(path, 'rt') as file:
+            yield from read_smiles_records(file)
+
+def read_chunks(records, chunk_size:int=INGESTION_CHUNK_SIZE):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def parse_file(path:str, chunk_size:int=INGESTION_CHUNK_SIZE, generation_strategy:FingerprintGenerator=None, data:dict=None, workers:int=None):
+    parsed = ParsedInput()
+    packed = []
+    position = 1
+    for chunk in read_chunks(read_records(path), chunk_size):
+        smiles, identifiers = zip(*chunk)
+        count = len(parsed.smiles)
+        parse_smiles(smiles, identifiers, parsed, position)
+        if generation_strategy is not None and parsed.molecules:
+            packed.append(MoleculeSet(parsed.smiles[count:], generation_strategy, data, parsed.molecules, workers).get_packed_fingerprints())
+            parsed.molecules = []
+        position += len(chunk)
+    if generation_strategy is not None:
+        parsed.molecules = None
+        parsed.packed_fingerprints = PackedFingerprints.concatenate(packed) if packed else PackedFingerprints()
+    return parsed
+
+def expire_uploads(directory:str, max_age:float=UPLOAD_MAX_AGE):
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+def save_upload(contents:str, filename:str, directory:str):
+    extension = get_input_format(filename) + ('.gz' if filename.lower().endswith('.gz') else '')
+    data = contents.split(',', 1)[1]
+    os.makedirs(directory, exist_ok=True)
+    expire_uploads(directory)
+    digest = hashlib.sha256()
+    try:
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            for start in range(0, len(data), UPLOAD_DECODE_BLOCK):
+                block = base64.b64decode(data[start:start + UPLOAD_DECODE_BLOCK])
+                digest.update(block)
+                file.write(block)
+    except ValueError:
+        os.remove(file.name)
+        raise ValueError(f"{filename} could not be decoded")
+    os.replace(file.name, os.path.join(directory, digest.hexdigest() + extension))
+    return {'filename': filename, 'token': digest.hexdigest(), 'extension': extension}
+
+def get_upload_path(upload:dict, directory:str):
+    if not re.fullmatch(r'[0-9a-f]{64}', upload.get('token', '')):
+        raise ValueError("Invalid upload token")
+    if upload.get('extension') not in [x + compression for x in INPUT_FORMATS for compression in ('', '.gz')]:
+        raise ValueError("Invalid upload extension")
+    return os.path.join(directory, upload['token'] + upload['extension'])
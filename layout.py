@@ -1,11 +1,39 @@
-from dash import html, dcc, callback, Output, Input, State, dash_table
+import os
+from dash import html, dcc, callback, Output, Input, State, dash_table, no_update, DiskcacheManager, callback_context
 from algorithms import *
+from transport import encode_strings, decode_strings, get_display_array
+from fingerprint_database import open_fingerprint_database
+from ingestion import parse_file, save_upload, get_upload_path
+from export import STREAM_FORMATS, get_export_tile_size, stream_pairs, stream_pair_table
+from cache import UPLOAD_DIRECTORY, molecule_cache, result_cache, job_cache, image_cache, library_cache, get_session_key, get_result_key, get_image_key, get_fingerprint_parameters, SubmitResult, RenderedImage
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import dash_bio as bio
 import plotly.figure_factory as ff
 from copy import deepcopy
 
+DENSE_VIEW_LIMIT = 5000
+TABLE_MAX_ROWS = 10000
+HEATMAP_TEXT_LIMIT = 30
+GRID_PAGE_SIZE = 12
+QUERY_TOP_K = 10
+DEFAULT_TOP_K = 10
+REFERENCE_LIBRARY_PATH = os.environ.get('REFERENCE_LIBRARY')
+GRID_MAX_NEIGHBOURS = 120
+GRID_LEGEND_LENGTH = 25
+HEATMAP_TILE_SIZE = 200
+INVALID_SMILES_LIMIT = 20
+DOWNLOAD_SCOPES = {'table': "Table pairs", 'all': "All pairs"}
+SUBMIT_STAGES = ['Parsing', 'Fingerprinting', 'Similarity', 'Clustering', 'Figures']
+
+background_callback_manager = DiskcacheManager(job_cache)
+if REFERENCE_LIBRARY_PATH and os.path.isdir(REFERENCE_LIBRARY_PATH):
+    reference_library = open_fingerprint_database(REFERENCE_LIBRARY_PATH, library_cache)
+elif REFERENCE_LIBRARY_PATH:
+    reference_library = load_reference_library(REFERENCE_LIBRARY_PATH, library_cache)
+else:
+    reference_library = None
+
 tversky_parametrs = html.Div([
                         dbc.Label("Weight a", className="ms-2 mb-2"),
                         dbc.Input(id="a-input", type="text", placeholder="Value between 0 and 1"),
@@ -81,8 +109,10 @@ maccs = html.Div([
         id="maccs-parameters")
 
 layout = dbc.Container([
-    dcc.Store(id='fingerprint-store-data'),
     dcc.Store(id='data-frame-data'),
+    dcc.Store(id='session-key-data'),
+    dcc.Store(id='result-key-data'),
+    dcc.Store(id='upload-data'),
     dbc.Row([
         dbc.Navbar(
             html.H2('Molecular Similarity Visualiser', className="ms-3 mt-2"), 
@@ -97,7 +127,21 @@ layout = dbc.Container([
                         className="text-left mb-3"),
                 dbc.Textarea(id="textarea-input",
                              className="mb-3", 
-                             placeholder="SMILES strings separated by comma"),
+                             placeholder="SMILES strings separated by commas or new lines"),
+                dcc.Upload(id="file-upload",
+                           children=html.Div(["Or drop a .smi, .csv or .sdf file here (optionally gzipped), or ", html.A("select one")]),
+                           style={
+                               "borderWidth": "1px",
+                               "borderStyle": "dashed",
+                               "borderRadius": "5px",
+                               "padding": "10px",
+                               "textAlign": "center"
+                           },
+                           className="mb-2"),
+                html.Div([
+                    html.Div(id="upload-status"),
+                    dbc.Button("Remove file", id="remove-upload-button", color="link", size="sm", n_clicks=0, className="d-none p-0")
+                ], className="mb-3"),
                 html.Div([
                     dbc.Label("Select fingerprint type"),
                     dbc.Select(options = [
@@ -108,6 +152,47 @@ layout = dbc.Container([
                     ],
                     id="fingerprint-type",
                     className="mb-3")]),
+                html.Div([
+                    dbc.Label("Select similarity engine"),
+                    dbc.Select(options = [
+                        {'label': 'RDKit', 'value': 'RDKit'},
+                        {'label': 'NumPy', 'value': 'NumPy'}
+                    ],
+                    value="RDKit",
+                    id="similarity-engine",
+                    className="mb-3")]),
+                html.Div([
+                    dbc.Label("Select similarity storage"),
+                    dbc.Select(options = [
+                        {'label': 'Double precision (float64)', 'value': 'float64'},
+                        {'label': 'Single precision (float32)', 'value': 'float32'},
+                        {'label': 'Quantized to 0.01 (uint8)', 'value': 'uint8'}
+                    ],
+                    value="float64",
+                    id="similarity-dtype",
+                    className="mb-3")]),
+                html.Div([
+                    dbc.Label("Select linkage method"),
+                    dbc.Select(options = [
+                        {'label': 'Complete', 'value': 'complete'},
+                        {'label': 'Average', 'value': 'average'},
+                        {'label': 'Single', 'value': 'single'},
+                        {'label': 'Weighted', 'value': 'weighted'}
+                    ],
+                    value="complete",
+                    id="linkage-method",
+                    className="mb-2"),
+                    dbc.Checkbox(id="approximate-clustering", label="Approximate clustering (sampled)", value=False, className="mb-3"),
+                    dbc.Checkbox(id="query-mode",
+                                 label=f"Search the reference library ({len(reference_library)} molecules)" if reference_library is not None else "Search the reference library (none loaded)",
+                                 value=False,
+                                 disabled=reference_library is None,
+                                 className="mb-3")]),
+                html.Div([
+                    dbc.Label("Nearest neighbours per molecule"),
+                    dbc.Input(id="top-k-input", type="number", min=1, step=1, value=10, className="mb-3"),
+                    dbc.Label("Similarity threshold"),
+                    dbc.Input(id="threshold-input", type="number", step=0.01, placeholder="Optional, e.g. 0.7", className="mb-3")]),
                 dbc.Collapse(
                     children=html.Div([
                         rdkit, 
@@ -119,6 +204,8 @@ layout = dbc.Container([
                     id="fingerprint-parameters-collapse",
                 ),
                 dbc.Button('Submit', id='submit-button', color='primary', className="mt-3 mb-3", n_clicks=0),
+                dbc.Button('Cancel', id='cancel-button', color='secondary', className="mt-3 mb-3 ms-2", n_clicks=0, disabled=True),
+                dbc.Progress(id="submit-progress", value=0, label="", className="mb-3 d-none"),
                 html.Div(id="generation-alert"),
                 html.Div(id="validation-alert")
             ], body = True)
@@ -255,12 +342,211 @@ def show_tversky_parameters(similarity_coefficient: str):
         return False
 
 
+@callback(
+    Output('upload-data', 'data'),
+    Output('upload-status', 'children'),
+    Output('remove-upload-button', 'className'),
+    Output('file-upload', 'contents'),
+    Input('file-upload', 'contents'),
+    Input('remove-upload-button', 'n_clicks'),
+    State('file-upload', 'filename'),
+    prevent_initial_call=True
+)
+def update_upload(contents:str, n_clicks:int, filename:str):
+    if callback_context.triggered_id == 'remove-upload-button':
+        return None, None, "d-none p-0", None
+    if contents is None:
+        return no_update, no_update, no_update, no_update
+    try:
+        upload = save_upload(contents, filename, UPLOAD_DIRECTORY)
+    except ValueError as error:
+        return None, dbc.Alert(str(error), className="mb-0", color="warning"), "d-none p-0", None
+    status = html.Div([dbc.Badge(filename, color="info", className="me-2"), "is used instead of the text input"])
+    return upload, status, "p-0", None
+
+
+def get_heatmap_figure(df:pd.DataFrame, similarity_coefficient:str):
+    quantized = np.issubdtype(df.values.dtype, np.integer)
+    heatmap = go.Figure(
+        data=go.Heatmap(
+            z=get_display_array(df.values),
+            x=df.columns,
+            y=df.index,
+            colorscale='RdBu',
+            colorbar=dict(title=f'{similarity_coefficient} Similarity', ticksuffix="%" if quantized else None),
+            texttemplate=None if len(df) > HEATMAP_TEXT_LIMIT else "%{z}%" if quantized else "%{z: .2f}",
+            hovertemplate=("Similarity: %{z}%" if quantized else "Similarity: %{z: .2f}") + "<br>y: %{y}<br>x: %{x}<extra></extra>"
+        )
+    )
+
+    if len(df.columns) <= 6 and all(map(lambda col: len(col) <= 35, df.columns)):
+        heatmap.update_layout(
+            xaxis_nticks=len(df.columns),
+            yaxis_nticks=len(df.index)
+        )
+    else:
+        heatmap.update_layout(
+            xaxis=dict(showticklabels=False),
+            yaxis=dict(showticklabels=False),
+            hoverlabel=dict(
+                font=dict(
+                    size=12
+                )
+            )
+        )
+    return heatmap
+
+
+def get_heatmap_tile_figure(data_frame_generator:DataFrameGenerator, tile:list, similarity_coefficient:str, pooling:str):
+    row_start, row_stop, column_start, column_stop = tile
+    values, row_edges, column_edges = data_frame_generator.get_similarity_tile(row_start, row_stop, column_start, column_stop, HEATMAP_TILE_SIZE, pooling)
+    quantized = np.issubdtype(values.dtype, np.integer)
+    pooled = len(row_edges) - 1 < row_stop - row_start or len(column_edges) - 1 < column_stop - column_start
+    heatmap = go.Figure(
+        data=go.Heatmap(
+            z=get_display_array(values),
+            x=column_start + (column_edges[:-1] + column_edges[1:] - 1) / 2,
+            y=row_start + (row_edges[:-1] + row_edges[1:] - 1) / 2,
+            colorscale='RdBu',
+            colorbar=dict(title=f'{similarity_coefficient} Similarity', ticksuffix="%" if quantized else None),
+            hovertemplate=("Similarity: %{z}%" if quantized else "Similarity: %{z: .2f}") + "<br>y: %{y:.0f}<br>x: %{x:.0f}<extra></extra>"
+        )
+    )
+    title = f"Molecules {row_start}-{row_stop - 1} × {column_start}-{column_stop - 1}"
+    if pooled:
+        title += f" ({pooling} pooled, zoom in for full resolution)"
+    heatmap.update_layout(
+        title=dict(text=title, font=dict(size=14)),
+        xaxis=dict(title="Molecule index"),
+        yaxis=dict(title="Molecule index"),
+        hoverlabel=dict(
+            font=dict(
+                size=12
+            )
+        )
+    )
+    return heatmap
+
+
+def get_dendrogram_figure(labels:list, clustering:Clustering):
+    dendrogram = ff.create_dendrogram(
+        np.empty((len(labels), 0)),
+        labels=labels,
+        orientation='left',
+        distfun=lambda _: clustering.distances,
+        linkagefun=lambda _: clustering.linkage)
+    dendrogram.update_traces(hoverinfo='x+y')
+    dendrogram.update_layout(
+        yaxis=dict(showticklabels=False),
+        width=900,
+        height=600
+    )
+    return dendrogram
+
+
+def get_clustergram_figure(df:pd.DataFrame, clustering:Clustering):
+    if len(df.columns) <= 6 and all(map(lambda col: len(col) <= 35, df.columns)):
+        return bio.Clustergram(
+                    data=df,
+                    column_labels=list(df.columns.values),
+                    row_labels=list(df.index),
+                    hidden_labels=['row'],
+                    display_ratio=[0.1, 0.75],
+                    dist_fun=lambda _, metric=None: clustering.distances,
+                    link_fun=lambda _, optimal_ordering=False: clustering.linkage
+                )
+    return bio.Clustergram(
+                data=df,
+                column_labels=list(df.columns.values),
+                row_labels=list(df.index),
+                dist_fun=lambda _, metric=None: clustering.distances,
+                link_fun=lambda _, optimal_ordering=False: clustering.linkage,
+                hidden_labels=['row', 'col'],
+                display_ratio=[0.1, 0.75],
+                height=600,
+                width=900
+            )
+
+
+def report_progress(set_progress, stage:str):
+    position = SUBMIT_STAGES.index(stage)
+    set_progress((100 * position // len(SUBMIT_STAGES), f"{stage}..."))
+
+
+def get_similarity_table(similarity_pairs:pd.DataFrame):
+    return dash_table.DataTable(
+        id='similarity-table',
+        columns=[{"name": col, "id": col, "type": "text"} for col in similarity_pairs.columns],
+        data=similarity_pairs.to_dict('records'),
+        page_size=10,
+        sort_action='native',
+        filter_action='native',
+        cell_selectable=True,
+        active_cell=None,
+        tooltip_header={
+            "Molecule 1": "Surround SMILES in quotation marks (\"\")",
+            "Molecule 2": "Surround SMILES in quotation marks (\"\")",
+            "Similarity": "Use numbers, >, =>, <, <=, = etc. e.g. >0.4"
+        }, 
+        tooltip_delay=0,
+        tooltip_duration=None,
+        style_table={
+            'overflowX': 'auto',
+            'maxWidth': '100%'
+        },
+        style_cell={
+            'whiteSpace': 'normal',  
+            'height': 'auto',            
+            'textAlign': 'left',
+            'minWidth': '50px',
+            'width': '200px',
+            'maxWidth': '150px',
+            'overflow': 'hidden',
+            'textOverflow': 'ellipsis'
+        },
+        style_cell_conditional=[
+            {
+                'if': {'column_id': 'Similarity'},
+                'width': '40px',
+                'minWidth': '20px',
+                'maxWidth': '40px',
+                'textAlign': 'center'
+            }
+        ],
+        style_data={
+            'whiteSpace': 'normal',
+            'height': 'auto',
+        }
+    )
+
+
+def get_graph_card(graph_id:str, figure:go.Figure):
+    return dbc.Card(
+        dcc.Graph(id=graph_id, figure=figure, style={'width': '98%', 'height': 'auto'}),
+        className="mb-3 mr-3"
+    )
+
+
+def get_dense_view_alert(molecule_count:int):
+    return dbc.Alert(f"This view is limited to {DENSE_VIEW_LIMIT} molecules ({molecule_count} submitted). The Table tab lists the nearest neighbours of every molecule.",
+                     className="mb-3", color="info")
+
+
+def get_invalid_smiles_alert(invalid:list):
+    return dbc.Alert([
+        html.Div(f"There are {len(invalid)} invalid SMILES strings:" if len(invalid) > 1 else "There is an invalid SMILES string:"),
+        html.Ul([html.Li(f"#{position}: {smiles}") for position, smiles in invalid[:INVALID_SMILES_LIMIT]]
+                + ([html.Li(f"... and {len(invalid) - INVALID_SMILES_LIMIT} more")] if len(invalid) > INVALID_SMILES_LIMIT else []), className="mb-0")
+    ], className="mb-3", color="warning")
+
+
 @callback(
     Output('validation-alert', 'children'),
     Output('visuals-column', 'children'),
-    Output('fingerprint-store-data', 'data'),
     Output('data-frame-data', 'data'),
     Output('generation-alert', 'children'),
+    Output('session-key-data', 'data'),
+    Output('result-key-data', 'data'),
     Input('submit-button', 'n_clicks'),
     State('fingerprint-type', 'value'),
     State('similarity-coefficient', 'value'),
@@ -273,10 +559,28 @@ def show_tversky_parameters(similarity_coefficient: str):
     State('fps-slider-morgan', 'value'),
     State('a-input', 'value'),
     State('b-input', 'value'),
-    prevent_intial_call=True
+    State('similarity-engine', 'value'),
+    State('top-k-input', 'value'),
+    State('threshold-input', 'value'),
+    State('similarity-dtype', 'value'),
+    State('linkage-method', 'value'),
+    State('approximate-clustering', 'value'),
+    State('query-mode', 'value'),
+    State('upload-data', 'data'),
+    prevent_intial_call=True,
+    background=True,
+    manager=background_callback_manager,
+    progress=[Output('submit-progress', 'value'), Output('submit-progress', 'label')],
+    running=[
+        (Output('cancel-button', 'disabled'), False, True),
+        (Output('submit-progress', 'className'), "mb-3", "mb-3 d-none")
+    ],
+    cancel=[Input('cancel-button', 'n_clicks')]
 )
-def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient:str=None, text_value:str=None, min_path:int=None, 
-                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None):
+def submit_form(set_progress, n_clicks: int, fingerprint_type:str=None, similarity_coefficient:str=None, text_value:str=None, min_path:int=None, 
+                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None,
+                similarity_engine:str="RDKit", top_k:int=None, threshold:float=None, similarity_dtype:str="float64",
+                linkage_method:str="complete", approximate_clustering:bool=False, query_mode:bool=False, upload:dict=None):
     
     data = {
         'min_path': min_path,
@@ -291,114 +595,79 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
 
     if n_clicks > 0:
         if not fingerprint_type:
-            return dbc.Alert("You must choose a fingerprint type!", className="mb-3", color="warning"), None, None, None, None
-        if not text_value or text_value.strip() == "":
-            return dbc.Alert("You must input at least two SMILES strings!", className="mb-3", color="warning"), None, None, None, None
+            return dbc.Alert("You must choose a fingerprint type!", className="mb-3", color="warning"), None, None, None, None, None
+        if not upload and (not text_value or text_value.strip() == ""):
+            return dbc.Alert("You must input at least two SMILES strings!", className="mb-3", color="warning"), None, None, None, None, None
+        if upload and not os.path.exists(get_upload_path(upload, UPLOAD_DIRECTORY)):
+            return dbc.Alert("The uploaded file is no longer available, please upload it again", className="mb-3", color="warning"), None, None, None, None, None
         if not similarity_coefficient:
-            return dbc.Alert("You must choose a similarity coefficient!", className="mb-3", color="warning"), None, None, None, None
+            return dbc.Alert("You must choose a similarity coefficient!", className="mb-3", color="warning"), None, None, None, None, None
         
 
         if weight_a is not None and weight_b is not None:
             if float(weight_a) < 0 or float(weight_a) > 1 or float(weight_b) < 0 or float(weight_b) > 1:
-                return dbc.Alert("Tversky parameters a and b must be between 0 and 1", className="mb-3", color="warning"), None, None, None, None
+                return dbc.Alert("Tversky parameters a and b must be between 0 and 1", className="mb-3", color="warning"), None, None, None, None, None
+
+        if top_k is not None and top_k < 1:
+            return dbc.Alert("The number of nearest neighbours must be at least 1", className="mb-3", color="warning"), None, None, None, None, None
+        if top_k is None and threshold is None:
+            top_k = DEFAULT_TOP_K
+
+        if query_mode and reference_library is None:
+            return dbc.Alert("No reference library is loaded, set the REFERENCE_LIBRARY environment variable to a SMILES file or fingerprint database", className="mb-3", color="warning"), None, None, None, None, None
 
-        if check_textarea_input(text_value) == False:
-            return dbc.Alert("There exists an invalid SMILES string!", className="mb-3", color="warning"), None, None, None, None
-        elif len(check_textarea_input(text_value)) < 2:
-            return dbc.Alert("There must be at least 2 SMILES strings!", className="mb-3", color="warning"), None, None, None, None
+        report_progress(set_progress, 'Parsing')
+        try:
+            parsed_input = parse_input(text_value, upload)
+        except ValueError as error:
+            return dbc.Alert(str(error), className="mb-3", color="warning"), None, None, None, None, None
+        if parsed_input.invalid:
+            return get_invalid_smiles_alert(parsed_input.invalid), None, None, None, None, None
+        elif len(parsed_input.smiles) < 2:
+            return dbc.Alert("There must be at least 2 distinct SMILES strings!", className="mb-3", color="warning"), None, None, None, None, None
         else:
-            data_frame_generator = DataFrameGenerator(smiles=check_textarea_input(text_value),
+            session_key = get_session_key(parsed_input.canonical_smiles, fingerprint_type, data)
+            data_frame_generator = DataFrameGenerator(smiles=parsed_input.smiles,
                                                     generation_strategy=fingerprint_type,
                                                     similarity_strategy=similarity_coefficient,
-                                                    data=data)
-            
-            df = data_frame_generator.get_data_frame()
-            fingerprint_dict = data_frame_generator.get_fingerprint_indices()
+                                                    data=data,
+                                                    molecule_set=molecule_cache.get(session_key),
+                                                    molecules=parsed_input.molecules,
+                                                    similarity_engine=similarity_engine,
+                                                    similarity_dtype=similarity_dtype)
 
-            head_length = 0
-            if len(df.columns) > 10:
-                head_length = 10
-            else:
-                head_length = len(df.columns)
+            report_progress(set_progress, 'Fingerprinting')
+            data_frame_generator.get_fingerprints()
+            molecule_cache.put(session_key, data_frame_generator.molecule_set)
+            smiles_list = data_frame_generator.smiles
 
-            
-            
-            masked_df = df.where(np.triu(np.ones(df.shape), k=1).astype(bool)).head(head_length)
-            similarity_series = masked_df.stack()
-            top_similar = similarity_series.sort_values(ascending=False)
-            top_similar_df = top_similar.reset_index()
-            top_similar_df.columns = ['Molecule 1', 'Molecule 2', 'Similarity']
-
-            swapped_df = top_similar_df.rename(columns={
-                                                        'Molecule 1': 'Molecule 2',
-                                                        'Molecule 2': 'Molecule 1'
-                                                    }
-                                                )[['Molecule 1', 'Molecule 2', 'Similarity']]
-            
-            full_symetric_df = pd.concat([top_similar_df, swapped_df], ignore_index=True)
-            full_symetric_df = full_symetric_df.sort_values(by='Similarity', ascending=False)
-
-
-            heatmap = go.Figure(
-                data=go.Heatmap(
-                    z=df.values,
-                    x=df.columns,
-                    y=df.index,
-                    colorscale='RdBu',
-                    colorbar=dict(title=f'{similarity_coefficient} Similarity'),
-                    text=df.values,
-                    texttemplate="%{text: .2f}",
-                    hovertemplate="Similarity: %{z: .2f}<br>y: %{y}<br>x: %{x}<extra></extra>"
-                )
-            )
-
-            smiles_list=df.index.astype(str).tolist()
-            dendrogram = ff.create_dendrogram(
-                df.values,
-                labels=smiles_list,
-                orientation='left')
-            dendrogram.update_traces(hoverinfo='x+y')
-            dendrogram.update_layout(
-                yaxis=dict(showticklabels=False),
-                width=900,
-                height=600
-            )
+            result_key = get_result_key(session_key, similarity_coefficient, similarity_engine, similarity_dtype, weight_a, weight_b,
+                                        top_k, threshold, linkage_method, approximate_clustering, query_mode)
+            result = result_cache.get(result_key)
+            if result is None:
+                options = {
+                    'similarity_coefficient': similarity_coefficient,
+                    'top_k': top_k,
+                    'threshold': threshold,
+                    'linkage_method': linkage_method,
+                    'approximate_clustering': approximate_clustering
+                }
+                report_progress(set_progress, 'Similarity')
+                if query_mode:
+                    query_result = data_frame_generator.get_query_result(reference_library, top_k or QUERY_TOP_K)
+                    result = SubmitResult(data_frame_generator, options, query_result, session_key=session_key)
+                else:
+                    if len(smiles_list) <= DENSE_VIEW_LIMIT:
+                        data_frame_generator.get_similarity_matrix()
+                    result = SubmitResult(data_frame_generator, options, session_key=session_key, identifiers=parsed_input.identifiers)
+                    report_progress(set_progress, 'Clustering')
+                    get_clustering_figures(result)
+                result_cache.put(result_key, result)
+            smiles_list = result.data_frame_generator.smiles
 
-            if len(df.columns) <= 6 and all(map(lambda col: len(col) <= 35, df.columns)):
-                heatmap.update_layout(
-                    xaxis_nticks=len(df.columns),
-                    yaxis_nticks=len(df.index)
-                )
-            else:
-                heatmap.update_layout(
-                    xaxis=dict(showticklabels=False),
-                    yaxis=dict(showticklabels=False),
-                    hoverlabel=dict(
-                        font=dict(
-                            size=12
-                        )
-                    )
-                )
+            report_progress(set_progress, 'Figures')
+            heatmap_content = get_heatmap_content(result)
 
-            if len(df.columns) <= 6 and all(map(lambda col: len(col) <= 35, df.columns)):
-                clustergram = bio.Clustergram(
-                            data=df,
-                            column_labels=list(df.columns.values),
-                            row_labels=list(df.index),
-                            hidden_labels=['row'],
-                            display_ratio=[0.1, 0.75]
-                        )
-            else:
-                clustergram = bio.Clustergram(
-                            data=df,
-                            column_labels=list(df.columns.values),
-                            row_labels=list(df.index),
-                            hidden_labels=['row', 'col'],
-                            display_ratio=[0.1, 0.75],
-                            height=600,
-                            width=900
-                        )
-            
             rdkit_legend = html.Div([
                                 html.Span(style={
                                     "display": "inline-block",
@@ -451,7 +720,7 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                         dbc.Col([
                             dbc.Label("Select molecule", className="mt-2 ms-2 mb-2"),
                                 dbc.Select(
-                                    options=[{"label": key, "value": key} for key in fingerprint_dict.keys()],
+                                    options=[{"label": key, "value": key} for key in smiles_list],
                                     id="smiles-select"
                                 )],
                                     width=6  
@@ -510,7 +779,7 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                         dbc.Col([
                             dbc.Label("Select reference molecule", className="mt-2 ms-2 mb-2"),
                                 dbc.Select(
-                                    options=[{"label": molecule, "value": molecule} for molecule in df.columns],
+                                    options=[{"label": molecule, "value": molecule} for molecule in smiles_list],
                                     id="molecule-select-1"
                                 )],
                                     width=5  
@@ -518,7 +787,7 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                         dbc.Col([
                             dbc.Label("Select probe molecule", className="mt-2 ms-2 mb-2"),
                                 dbc.Select(
-                                    options=[{"label": molecule, "value": molecule} for molecule in df.columns],
+                                    options=[{"label": molecule, "value": molecule} for molecule in smiles_list],
                                     id="molecule-select-2"
                                 )],
                                     width=5
@@ -543,58 +812,13 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
 
             
 
-            table = dash_table.DataTable(
-                id='similarity-table',
-                columns=[{"name": col, "id": col, "type": "text"} for col in full_symetric_df.columns],
-                data=full_symetric_df.to_dict('records'),
-                page_size=10,
-                sort_action='native',
-                filter_action='native',
-                cell_selectable=True,
-                active_cell=None,
-                tooltip_header={
-                    "Molecule 1": "Surround SMILES in quotation marks (\"\")",
-                    "Molecule 2": "Surround SMILES in quotation marks (\"\")",
-                    "Similarity": "Use numbers, >, =>, <, <=, = etc. e.g. >0.4"
-                }, 
-                tooltip_delay=0,
-                tooltip_duration=None,
-                style_table={
-                    'overflowX': 'auto',
-                    'maxWidth': '100%'
-                },
-                style_cell={
-                    'whiteSpace': 'normal',  
-                    'height': 'auto',            
-                    'textAlign': 'left',
-                    'minWidth': '50px',
-                    'width': '200px',
-                    'maxWidth': '150px',
-                    'overflow': 'hidden',
-                    'textOverflow': 'ellipsis'
-                },
-                style_cell_conditional=[
-                    {
-                        'if': {'column_id': 'Similarity'},
-                        'width': '40px',
-                        'minWidth': '20px',
-                        'maxWidth': '40px',
-                        'textAlign': 'center'
-                    }
-                ],
-                style_data={
-                    'whiteSpace': 'normal',
-                    'height': 'auto',
-                }
-            )
-
             molecule_image = dbc.Card([
                 dbc.CardBody([
                     dbc.Row([
                         dbc.Col([
                             dbc.Label("Select molecule", className="mt-2 ms-2 mb-2"),
                                 dbc.Select(
-                                    options=[{"label": key, "value": key} for key in fingerprint_dict.keys()],
+                                    options=[{"label": key, "value": key} for key in smiles_list],
                                     id="molecule-select"
                                 )])
                             ], className="mb-3")]),
@@ -605,34 +829,66 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                     style={"width": "40%", "height": "auto"} ,
                     className="mx-auto d-block mb-1"
                 )])
+
+            molecule_grid = dbc.Card([
+                dbc.CardBody([
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Label("Select molecule", className="mt-2 ms-2 mb-2"),
+                                dbc.Select(
+                                    options=[{"label": key, "value": key} for key in smiles_list],
+                                    id="grid-molecule-select"
+                                )],
+                                    width=5
+                                    ),
+                        dbc.Col([
+                            dbc.Label("Show", className="mt-2 ms-2 mb-2"),
+                                dbc.Select(
+                                    options=[
+                                        {"label": "Nearest neighbours", "value": "neighbours"},
+                                        {"label": "Cluster members", "value": "cluster"}
+                                    ],
+                                    value="neighbours",
+                                    id="grid-mode"
+                                )],
+                                    width=4
+                                    ),
+                        dbc.Col([
+                            dbc.Label("Number of clusters", className="mt-2 ms-2 mb-2"),
+                                dbc.Input(id="grid-cluster-count", type="number", min=1, step=1, value=10)],
+                                    width=3
+                                    )
+                            ], className="mb-3"),
+                    dbc.Pagination(id="grid-pagination", max_value=1, active_page=1, fully_expanded=False, className="justify-content-center")
+                    ]),
+                dbc.CardImg(
+                    src=None,
+                    bottom=True,
+                    id="card-img-grid",
+                    style={"width": "90%", "height": "auto"} ,
+                    className="mx-auto d-block mb-1"
+                )])
             
             show_bits_tab = fingerprint_type in ["RDKit", "Morgan"]
             show_similarity_map_tab = fingerprint_type in ["Morgan", "AtomPairs"] and similarity_coefficient != "Tversky"
             tabs = dbc.Tabs(
                 [
                     dbc.Tab(
-                        dbc.Card(
-                            dcc.Graph(id='heatmap', figure=heatmap, style={'width': '98%', 'height': 'auto'}),
-                            className="mb-3 mr-3"
-                            ),
-                        label='Heatmap'),
+                        html.Div(heatmap_content, id="heatmap-content"),
+                        label='Heatmap',
+                        tab_id="heatmap-tab"),
                     dbc.Tab(
-                        dbc.Card(
-                            dcc.Graph(id='dendrogram', figure=dendrogram, style={'width': '98%', 'height': 'auto'}),
-                            className="mb-3 mr-3"
-                        ),
-                        label="Dendrogram"),
+                        html.Div(id="dendrogram-content"),
+                        label="Dendrogram",
+                        tab_id="dendrogram-tab"),
                     dbc.Tab(
-                        dbc.Card(
-                            dcc.Graph(id="clustergram", figure=clustergram, style={'width': '98%', 'height': 'auto'}),
-                            className="mb-3 mr-3"
-                            ),
-                        label="Clustergram"),
+                        html.Div(id="clustergram-content"),
+                        label="Clustergram",
+                        tab_id="clustergram-tab"),
                     dbc.Tab(
-                        dbc.Card(
-                            dbc.CardBody(table),
-                        ),
+                        html.Div([get_download_links(result_key, query_mode), html.Div(id="table-content")]),
                         label="Table",
+                        tab_id="table-tab",
                         className="mb-3 mr-3"),
                     dbc.Tab(
                         molecule_image,
@@ -640,6 +896,12 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                             id="molecule-image-tab",
                             tab_id="molecule-image",
                             className="mb-3 mr-3"),
+                    dbc.Tab(
+                        molecule_grid,
+                            label="Molecule Grid",
+                            id="molecule-grid-tab",
+                            tab_id="molecule-grid",
+                            className="mb-3 mr-3"),
                     dbc.Tab(
                         fingerprint_bits,
                             label="Fingerprint Bits", 
@@ -654,12 +916,215 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
                             tab_style={"display": "none"} if not show_similarity_map_tab else {},
                             tab_id="similarity-map-tab-id",
                             className="mb-3 mr-3")
-                ]
+                ],
+                id="visual-tabs",
+                active_tab="heatmap-tab"
             )
 
             generation_alert = dbc.Alert("NOTE: Changing parameters on the dashboard doesn't change the visualisations until you press the SUBMIT button.", className="mb-3", color="info")
 
-            return None, tabs, fingerprint_dict, list(df.columns), generation_alert
+            rendered_tabs = dcc.Store(id='rendered-tabs-data', data=["heatmap-tab"])
+
+            return None, [tabs, rendered_tabs], encode_strings(smiles_list), generation_alert, session_key, result_key
+
+
+def get_query_mode_alert():
+    return dbc.Alert("This view is not available when searching the reference library.", className="mb-3", color="info")
+
+
+def get_heatmap_content(result:SubmitResult):
+    if result.query_result is not None:
+        return get_graph_card('heatmap', get_heatmap_figure(result.query_result.get_data_frame(), result.options['similarity_coefficient']))
+    data_frame_generator = result.data_frame_generator
+    if len(data_frame_generator.smiles) > DENSE_VIEW_LIMIT:
+        return get_dense_view_alert(len(data_frame_generator.smiles))
+    molecule_count = len(data_frame_generator.smiles)
+    if molecule_count > HEATMAP_TILE_SIZE:
+        tile = [0, molecule_count, 0, molecule_count]
+        figure = get_heatmap_tile_figure(data_frame_generator, tile, result.options['similarity_coefficient'], HEATMAP_POOLING[0])
+        return html.Div([
+            dbc.RadioItems(
+                options=[{"label": f"{pooling.capitalize()} pooling", "value": pooling} for pooling in HEATMAP_POOLING],
+                value=HEATMAP_POOLING[0],
+                id="heatmap-pooling",
+                inline=True,
+                className="mb-2"
+            ),
+            get_graph_card('heatmap-tiled', figure),
+            dcc.Store(id='heatmap-tile-data', data=tile)
+        ])
+    df = data_frame_generator.get_data_frame()
+    return get_graph_card('heatmap', get_heatmap_figure(df, result.options['similarity_coefficient']))
+
+
+def get_heatmap_tile(relayout_data:dict, tile:list, molecule_count:int):
+    if not relayout_data or relayout_data.get('xaxis.autorange') or relayout_data.get('yaxis.autorange'):
+        return [0, molecule_count, 0, molecule_count]
+    tile = list(tile)
+    for axis, position in (('yaxis', 0), ('xaxis', 2)):
+        if f'{axis}.range[0]' in relayout_data:
+            low, high = relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']
+        elif f'{axis}.range' in relayout_data:
+            low, high = relayout_data[f'{axis}.range']
+        else:
+            continue
+        start = min(max(0, int(np.floor(min(low, high) + 0.5))), molecule_count - 1)
+        stop = max(min(molecule_count, int(np.ceil(max(low, high) + 0.5))), start + 1)
+        tile[position:position + 2] = [start, stop]
+    return tile
+
+
+@callback(
+    Output('heatmap-tiled', 'figure'),
+    Output('heatmap-tile-data', 'data'),
+    Input('heatmap-tiled', 'relayoutData'),
+    Input('heatmap-pooling', 'value'),
+    State('heatmap-tile-data', 'data'),
+    State('result-key-data', 'data'),
+    prevent_initial_call=True
+)
+def update_heatmap_tile(relayout_data:dict, pooling:str, tile:list, result_key:str):
+    result = result_cache.get(result_key) if result_key else None
+    if result is None:
+        return no_update, no_update
+    molecule_count = len(result.data_frame_generator.smiles)
+    new_tile = get_heatmap_tile(relayout_data, tile, molecule_count)
+    if new_tile == tile and callback_context.triggered_id == 'heatmap-tiled':
+        return no_update, no_update
+    figure = get_heatmap_tile_figure(result.data_frame_generator, new_tile, result.options['similarity_coefficient'], pooling)
+    return figure, new_tile
+
+
+def get_clustering_figures(result:SubmitResult):
+    data_frame_generator = result.data_frame_generator
+    smiles_list = data_frame_generator.smiles
+    approximate = result.options['approximate_clustering'] or len(smiles_list) > DENSE_VIEW_LIMIT
+    clustering = data_frame_generator.get_clustering(result.options['linkage_method'], approximate)
+    leaf_labels = clustering.get_leaf_labels(smiles_list)
+    return clustering, leaf_labels
+
+
+def get_dendrogram_content(result:SubmitResult):
+    if result.query_result is not None:
+        return get_query_mode_alert()
+    clustering, leaf_labels = get_clustering_figures(result)
+    return get_graph_card('dendrogram', get_dendrogram_figure(leaf_labels, clustering))
+
+
+def get_clustergram_content(result:SubmitResult):
+    if result.query_result is not None:
+        return get_query_mode_alert()
+    clustering, leaf_labels = get_clustering_figures(result)
+    if clustering.similarity is not None:
+        clustergram_df = pd.DataFrame(clustering.similarity, index=leaf_labels, columns=leaf_labels)
+    else:
+        clustergram_df = result.data_frame_generator.get_data_frame()
+    return get_graph_card('clustergram', get_clustergram_figure(clustergram_df.round(2), clustering))
+
+
+def get_table_content(result:SubmitResult):
+    if result.query_result is not None:
+        similarity_pairs = result.query_result.get_pairs()
+    else:
+        similarity_pairs = result.data_frame_generator.get_similarity_pairs(result.options['top_k'], result.options['threshold'], TABLE_MAX_ROWS)
+    return dbc.Card(
+        dbc.CardBody(get_similarity_table(similarity_pairs.head(TABLE_MAX_ROWS))),
+    )
+
+
+def get_download_links(result_key:str, query_mode:bool):
+    scopes = ['table'] if query_mode else list(DOWNLOAD_SCOPES)
+    return html.Div([html.Span("Download", className="me-2")] + [
+        dbc.Button(f"{DOWNLOAD_SCOPES[scope]} (.{pair_format})",
+                   href=f"/download/{result_key}?format={pair_format}&scope={scope}",
+                   external_link=True,
+                   color="primary",
+                   outline=True,
+                   size="sm",
+                   className="me-2 mb-2")
+        for scope in scopes for pair_format in STREAM_FORMATS
+    ], className="mt-3")
+
+
+def get_download_stream(result:SubmitResult, pair_format:str, scope:str):
+    if result.query_result is not None:
+        return stream_pair_table(result.query_result.get_pairs(), pair_format)
+    data_frame_generator = result.data_frame_generator
+    top_k, threshold = (result.options['top_k'], result.options['threshold']) if scope == 'table' else (None, None)
+    tiles = data_frame_generator.iter_neighbours(top_k, threshold, get_export_tile_size(len(data_frame_generator.smiles), top_k))
+    return stream_pairs(tiles, pair_format, data_frame_generator.smiles, result.identifiers)
+
+
+LAZY_TABS = {
+    'heatmap-tab': get_heatmap_content,
+    'dendrogram-tab': get_dendrogram_content,
+    'clustergram-tab': get_clustergram_content,
+    'table-tab': get_table_content
+}
+
+
+@callback(
+    Output('heatmap-content', 'children'),
+    Output('dendrogram-content', 'children'),
+    Output('clustergram-content', 'children'),
+    Output('table-content', 'children'),
+    Output('rendered-tabs-data', 'data'),
+    Input('visual-tabs', 'active_tab'),
+    State('result-key-data', 'data'),
+    State('rendered-tabs-data', 'data')
+)
+def render_tab(active_tab:str, result_key:str, rendered_tabs:list):
+    outputs = [no_update] * len(LAZY_TABS)
+    if active_tab not in LAZY_TABS or active_tab in rendered_tabs:
+        return *outputs, no_update
+
+    position = list(LAZY_TABS).index(active_tab)
+    result = result_cache.get(result_key) if result_key else None
+    if result is None:
+        outputs[position] = dbc.Alert("These results are no longer cached, please press the SUBMIT button again.", className="mb-3", color="warning")
+    else:
+        outputs[position] = LAZY_TABS[active_tab](result)
+    return *outputs, rendered_tabs + [active_tab]
+
+
+def get_cached_image(render, *key_parts):
+    key = get_image_key(*key_parts)
+    image = image_cache.get(key)
+    if image is None:
+        image = RenderedImage(render())
+        image_cache.put(key, image)
+    return image.data_uri
+
+
+def get_fingerprint_setting(data_frame_generator:DataFrameGenerator):
+    fingerprint_type = data_frame_generator.fingerprint_type
+    return fingerprint_type, get_fingerprint_parameters(fingerprint_type, data_frame_generator.molecule_set.data)
+
+
+def parse_input(text_value:str, upload:dict):
+    if upload:
+        return parse_file(get_upload_path(upload, UPLOAD_DIRECTORY))
+    return parse_textarea_input(text_value)
+
+
+def get_cached_data_frame_generator(session_key:str, fingerprint_type:str, similarity_coefficient:str, text_value:str, data:dict, upload:dict=None):
+    molecule_set = molecule_cache.get(session_key) if session_key else None
+    if molecule_set is None:
+        parsed_input = parse_input(text_value, upload)
+        session_key = get_session_key(parsed_input.canonical_smiles, fingerprint_type, data)
+        data_frame_generator = DataFrameGenerator(smiles=parsed_input.smiles,
+                                                  generation_strategy=fingerprint_type,
+                                                  similarity_strategy=similarity_coefficient,
+                                                  data=data,
+                                                  molecules=parsed_input.molecules)
+        molecule_cache.put(session_key, data_frame_generator.molecule_set)
+        return data_frame_generator
+
+    return DataFrameGenerator(smiles=molecule_set.smiles,
+                              generation_strategy=fingerprint_type,
+                              similarity_strategy=similarity_coefficient,
+                              data=data,
+                              molecule_set=molecule_set)
 
 
 @callback(
@@ -676,10 +1141,13 @@ def submit_form(n_clicks: int, fingerprint_type:str=None, similarity_coefficient
     State('fps-slider-morgan', 'value'),
     State('a-input', 'value'),
     State('b-input', 'value'),
+    State('session-key-data', 'data'),
+    State('upload-data', 'data'),
     prevent_intial_call=True
 )
 def get_molecule_image(smiles:str, fingerprint_type: str, similarity_coefficient: str, text_value: str, min_path:int=None, 
-                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None):
+                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None,
+                session_key:str=None, upload:dict=None):
     
     data = {
         'min_path': min_path,
@@ -692,13 +1160,54 @@ def get_molecule_image(smiles:str, fingerprint_type: str, similarity_coefficient
         'b': weight_b
     }
 
-    data_frame_generator = DataFrameGenerator(
-        smiles=check_textarea_input(text_value),
-        generation_strategy=fingerprint_type,
-        similarity_strategy=similarity_coefficient,
-        data=data)
-            
-    return data_frame_generator.get_molecule_image(smiles)
+    def render():
+        data_frame_generator = get_cached_data_frame_generator(session_key, fingerprint_type, similarity_coefficient, text_value, data, upload)
+        return data_frame_generator.get_molecule_image(smiles)
+
+    return get_cached_image(render, 'molecule', get_canonical_smiles(smiles), MOLECULE_IMAGE_SIZE, MOLECULE_IMAGE_FORMAT)
+
+def get_grid_legend(smiles:str):
+    if len(smiles) <= GRID_LEGEND_LENGTH:
+        return smiles
+    return smiles[:GRID_LEGEND_LENGTH - 3] + "..."
+
+
+@callback(
+    Output('card-img-grid', 'src'),
+    Output('grid-pagination', 'max_value'),
+    Output('grid-pagination', 'active_page'),
+    Input('grid-molecule-select', 'value'),
+    Input('grid-mode', 'value'),
+    Input('grid-cluster-count', 'value'),
+    Input('grid-pagination', 'active_page'),
+    State('result-key-data', 'data'),
+    prevent_initial_call=True
+)
+def get_molecule_grid_image(smiles:str, mode:str, cluster_count:int, active_page:int, result_key:str):
+    result = result_cache.get(result_key) if result_key else None
+    if smiles is None or result is None:
+        return None, 1, 1
+
+    data_frame_generator = result.data_frame_generator
+    if mode == "cluster":
+        clustering, _ = get_clustering_figures(result)
+        members = data_frame_generator.get_cluster_members(smiles, clustering, cluster_count or 1)
+        legends = [get_grid_legend(x) for x in members]
+    else:
+        members, similarities = data_frame_generator.get_neighbours(smiles, GRID_MAX_NEIGHBOURS)
+        legends = [f"{x:.2f}" for x in similarities]
+
+    page_count = max(1, -(-len(members) // GRID_PAGE_SIZE))
+    page = min(active_page or 1, page_count) if callback_context.triggered_id == 'grid-pagination' else 1
+    start = (page - 1) * GRID_PAGE_SIZE
+    page_members = members[start:start + GRID_PAGE_SIZE]
+    page_legends = legends[start:start + GRID_PAGE_SIZE]
+
+    image = get_cached_image(lambda: data_frame_generator.get_molecule_grid(page_members, page_legends), 'grid',
+                             tuple(get_canonical_smiles(x) for x in page_members), tuple(page_legends),
+                             GRID_COLUMNS, GRID_IMAGE_SIZE, GRID_IMAGE_FORMAT)
+    return image, page_count, page
+
 
 @callback(
     Output('bit-select', 'options'),
@@ -706,11 +1215,38 @@ def get_molecule_image(smiles:str, fingerprint_type: str, similarity_coefficient
     Output('card-img-bit', 'src', allow_duplicate=True),
     Output('fingerprint-legend', 'className', allow_duplicate=True),
     Input('smiles-select', 'value'),
-    State('fingerprint-store-data', 'data'),
+    State('fingerprint-type', 'value'),
+    State('similarity-coefficient', 'value'),
+    State('textarea-input', 'value'),
+    State('min-path-slider', 'value'),
+    State('max-path-slider', 'value'),
+    State('fps-slider-rdkit', 'value'),
+    State('fps-slider-atompairs', 'value'),
+    State('radius-slider', 'value'),
+    State('fps-slider-morgan', 'value'),
+    State('a-input', 'value'),
+    State('b-input', 'value'),
+    State('session-key-data', 'data'),
+    State('upload-data', 'data'),
     prevent_initial_call='initial_duplicate'
 )
-def get_fingerprint_bit_select(value:str, data:dict):
-    fingerprint_indices = data[value]
+def get_fingerprint_bit_select(value:str, fingerprint_type: str, similarity_coefficient: str, text_value: str, min_path:int=None, 
+                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None,
+                session_key:str=None, upload:dict=None):
+    
+    data = {
+        'min_path': min_path,
+        'max_path': max_path,
+        'fps_rdkit': fps_rdkit,
+        'fps_atompairs': fps_atompairs,
+        'radius': radius, 
+        'fps_morgan': fps_morgan,
+        'a': weight_a,
+        'b': weight_b
+    }
+
+    data_frame_generator = get_cached_data_frame_generator(session_key, fingerprint_type, similarity_coefficient, text_value, data, upload)
+    fingerprint_indices = data_frame_generator.molecule_set.get_on_bits(value)
     return [{"label": bit, "value": bit} for bit in fingerprint_indices], None, None, "d-none"
 
 @callback(
@@ -729,10 +1265,13 @@ def get_fingerprint_bit_select(value:str, data:dict):
     State('fps-slider-morgan', 'value'),
     State('a-input', 'value'),
     State('b-input', 'value'),
+    State('session-key-data', 'data'),
+    State('upload-data', 'data'),
     prevent_intial_call=True
 )
 def get_fingerprint_image(bit_value: int, smiles:str, fingerprint_type: str, similarity_coefficient: str, text_value: str, min_path:int=None, 
-                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None):
+                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None,
+                session_key:str=None, upload:dict=None):
     
     data = {
         'min_path': min_path,
@@ -745,13 +1284,10 @@ def get_fingerprint_image(bit_value: int, smiles:str, fingerprint_type: str, sim
         'b': weight_b
     }
 
-    data_frame_generator = DataFrameGenerator(
-        smiles=check_textarea_input(text_value),
-        generation_strategy=fingerprint_type,
-        similarity_strategy=similarity_coefficient,
-        data=data)
-            
-    return data_frame_generator.get_fingerprint_bit_image(smiles, bit_value), "ms-3 mb-3 mr-3"
+    data_frame_generator = get_cached_data_frame_generator(session_key, fingerprint_type, similarity_coefficient, text_value, data, upload)
+    image = get_cached_image(lambda: data_frame_generator.get_fingerprint_bit_image(smiles, bit_value), 'bit', get_canonical_smiles(smiles),
+                             *get_fingerprint_setting(data_frame_generator), int(bit_value), 'svg')
+    return image, "ms-3 mb-3 mr-3"
             
 @callback(
     Output("molecule-select-1", "options"),
@@ -761,6 +1297,7 @@ def get_fingerprint_image(bit_value: int, smiles:str, fingerprint_type: str, sim
     State('data-frame-data', 'data')  
 )
 def update_molecule_select_options(selected1, selected2, molecules):
+    molecules = decode_strings(molecules)
     options1 = [{"label": mol, "value": mol, "disabled": (mol == selected2)} for mol in molecules]
     options2 = [{"label": mol, "value": mol, "disabled": (mol == selected1)} for mol in molecules]
 
@@ -783,10 +1320,13 @@ def update_molecule_select_options(selected1, selected2, molecules):
     State('fps-slider-morgan', 'value'),
     State('a-input', 'value'),
     State('b-input', 'value'),
+    State('session-key-data', 'data'),
+    State('upload-data', 'data'),
     prevent_intial_call=True
 )
 def get_similarity_map_image(n_clicks: int, smiles1:str, smiles2:str, fingerprint_type: str, similarity_coefficient: str, text_value: str, min_path:int=None, 
-                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None):
+                max_path:int=None, fps_rdkit:int = None, fps_atompairs:int = None, radius:int = None, fps_morgan:int = None, weight_a:str=None, weight_b:str=None,
+                session_key:str=None, upload:dict=None):
     
     data = {
         'min_path': min_path,
@@ -799,11 +1339,9 @@ def get_similarity_map_image(n_clicks: int, smiles1:str, smiles2:str, fingerprin
         'b': weight_b
     }
 
-    data_frame_generator = DataFrameGenerator(
-        smiles=check_textarea_input(text_value),
-        generation_strategy=fingerprint_type,
-        similarity_strategy=similarity_coefficient,
-        data=data)
-            
-    return data_frame_generator.get_similarity_map(smiles1, smiles2), "mb-3"
+    data_frame_generator = get_cached_data_frame_generator(session_key, fingerprint_type, similarity_coefficient, text_value, data, upload)
+    image = get_cached_image(lambda: data_frame_generator.get_similarity_map(smiles1, smiles2), 'similarity-map',
+                             get_canonical_smiles(smiles1), get_canonical_smiles(smiles2), *get_fingerprint_setting(data_frame_generator),
+                             similarity_coefficient, SIMILARITY_MAP_SIZE, SIMILARITY_MAP_FORMAT)
+    return image, "mb-3"
     
\ No newline at end of file
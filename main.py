@@ -1,11 +1,25 @@
 from dash import Dash
+from flask import Response, abort, request, stream_with_context
 import dash_bootstrap_components as dbc
-from layout import layout
+from layout import layout, result_cache, get_download_stream, DOWNLOAD_SCOPES, STREAM_FORMATS
 
 external_stylesheets = [dbc.themes.LUMEN]
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 
 app.layout = layout
 
+@app.server.route('/download/<result_key>')
+def download_pairs(result_key:str):
+    pair_format = request.args.get('format', 'csv.gz')
+    scope = request.args.get('scope', 'table')
+    if pair_format not in STREAM_FORMATS or scope not in DOWNLOAD_SCOPES:
+        abort(400)
+    result = result_cache.get(result_key)
+    if result is None:
+        abort(404)
+    return Response(stream_with_context(get_download_stream(result, pair_format, scope)),
+                    mimetype=STREAM_FORMATS[pair_format],
+                    headers={'Content-Disposition': f'attachment; filename="similarity-pairs-{scope}.{pair_format}"'})
+
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
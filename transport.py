@@ -0,0 +1,47 @@
+import base64
+import io
+import zlib
+import numpy as np
+from PIL import Image
+
+COMPRESSION_LEVEL = 6
+PNG_COMPRESS_LEVEL = 9
+WEBP_QUALITY = 80
+WEBP_METHOD = 4
+WEBP_LOSSLESS = False
+
+def encode_bytes(data:bytes):
+    return base64.b64encode(zlib.compress(data, COMPRESSION_LEVEL)).decode('ascii')
+
+def decode_bytes(data:str):
+    return zlib.decompress(base64.b64decode(data))
+
+def encode_strings(values:list):
+    return encode_bytes("\n".join(values).encode('utf-8'))
+
+def decode_strings(data:str):
+    text = decode_bytes(data).decode('utf-8')
+    return text.split("\n") if text else []
+
+def get_display_array(values:np.ndarray):
+    if values.dtype == np.float64:
+        return values.astype(np.float32)
+    return values
+
+def get_data_uri(data:bytes, mime_type:str):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+def encode_image(image:Image.Image, image_format:str):
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    elif image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=WEBP_METHOD, lossless=WEBP_LOSSLESS)
+    else:
+        raise ValueError(f"Unknown raster image format: {image_format}")
+    return get_data_uri(buffer.getvalue(), f'image/{image_format}')
+
+def encode_drawing(drawing, image_format:str):
+    if image_format == 'svg':
+        return get_data_uri(drawing.encode('utf-8'), 'image/svg+xml')
+    return encode_image(Image.open(io.BytesIO(drawing)), image_format)